@@ -0,0 +1,36 @@
+import argparse
+import json
+import sys
+from benchmark import suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Performance benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--output", "-o", help="JSON file to write the results to")
+    run.add_argument("--benchmark", "-b", action="append", help="benchmark to run, repeatable")
+    run.add_argument("--sizes", type=int, help="number of sizes per benchmark, smallest first")
+    run.add_argument("--repeat", type=int, default=3, help="number of timed calls per size")
+    compare = commands.add_parser("compare", help="compare results against a baseline")
+    compare.add_argument("baseline", help="baseline JSON results")
+    compare.add_argument("current", help="current JSON results")
+    compare.add_argument("--tolerance", type=float, default=0.2, help="relative tolerance")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        suite.run(args.benchmark, args.sizes, args.repeat, args.output)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = suite.compare(baseline, current, args.tolerance)
+    for name, size, metric, base, value in regressions:
+        print("REGRESSION {} {} {}: {:.6g} -> {:.6g} ({:+.1%})".format(name, size, metric, base, value, value / base - 1))
+    print("{} regressions".format(len(regressions)))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
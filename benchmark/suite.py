@@ -0,0 +1,201 @@
+import json
+import os
+import platform
+import time
+import tracemalloc
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from explorer_util.datasource import DataDecoder
+from pyspatialfield.field.featurefield import FeatureField, EllipseFeature
+from pyspatialfield.field.featuretable import FeatureTable
+from pyspatialfield.field.labeling import label_tiled
+from sequence.discrete import Series
+from pycomponents.component import ComponentEvaluator
+
+
+class Benchmark(object):
+    """
+    A benchmark over a range of input sizes. setup(size) returns the function to time, and
+    items(size) the number of items, e.g. pixels or rows, that one call processes.
+    """
+
+    def __init__(self, name, setup, sizes, items):
+        self.name = name
+        self.setup = setup
+        self.sizes = sizes
+        self.items = items
+
+    def __repr__(self):
+        return "Benchmark ({})".format(self.name)
+
+    def run(self, size, repeat=3):
+        """
+        Time the benchmark at one size.
+        :return: dictionary of name, size, seconds (best of repeat), throughput (items per second)
+            and peak_bytes (peak traced memory of one call)
+        """
+        func = self.setup(size)
+        func()
+        seconds = min(_timed(func) for _ in range(repeat))
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {"name": self.name, "size": size, "seconds": seconds,
+                "throughput": self.items(size) / seconds if seconds > 0 else float("inf"), "peak_bytes": peak}
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _blobs(size, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size), dtype=np.float32)
+    n = max(1, size * size // 2000)
+    rows, cols = rng.integers(0, size - 8, n), rng.integers(0, size - 8, n)
+    for r, c in zip(rows, cols):
+        image[r:r + rng.integers(2, 8), c:c + rng.integers(2, 8)] = 255
+    return image
+
+
+def _png(image):
+    buf = BytesIO()
+    Image.fromarray(image.astype(np.uint8)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _moments(size):
+    field_data = _blobs(size)
+
+    def run():
+        field = FeatureField(field_data)
+        field.rad
+        EllipseFeature().from_feature_field(field)
+    return run
+
+
+def _feature_table(size):
+    _, labeled_map = FeatureField.generate_from_single_image(DataDecoder(_png(_blobs(size))))
+    return lambda: FeatureTable.from_labelmap(labeled_map)
+
+
+def _single_image(size):
+    buf = _png(_blobs(size))
+    return lambda: FeatureField.generate_from_single_image(DataDecoder(buf))
+
+
+def _image_diff(size):
+    background = np.random.default_rng(1).normal(100, 2, (size, size)).astype(np.float32)
+    foreground = background + _blobs(size)
+    return lambda: FeatureField.generate_from_image_diff(foreground, background)
+
+
+def _label(size):
+    from scipy import ndimage
+    binary = _blobs(size) > 0
+    return lambda: ndimage.label(binary)
+
+
+def _label_tiled(workers):
+    def setup(size):
+        binary = _blobs(size) > 0
+        return lambda: label_tiled(binary, (size // 4, size // 4), workers)
+    return setup
+
+
+def _decode(size):
+    buf = _png(_blobs(size))
+    return lambda: DataDecoder(buf).decode()
+
+
+def _series_segments(size):
+    series = Series(time=np.arange(size), values=np.random.default_rng(2).normal(size=size))
+    lowers = np.random.default_rng(3).integers(0, size, 1000)
+    return lambda: series.segments(lowers, lowers + size // 100)
+
+
+def _series_regression(size):
+    series = Series(time=np.arange(size), values=np.random.default_rng(4).normal(size=size))
+
+    def run():
+        series.linear_coefficients()
+        series.rolling_linear_coefficients(100)
+    return run
+
+
+def _components(size):
+    data = np.random.default_rng(5).normal(size=(size, 20))
+    return lambda: list(ComponentEvaluator(data))
+
+
+IMAGE_SIZES = [256, 512, 1024, 2048]
+LABEL_SIZES = [1024, 2048, 4096]
+SERIES_SIZES = [10 ** 4, 10 ** 5, 10 ** 6]
+
+BENCHMARKS = [
+    Benchmark("featurefield_moments", _moments, IMAGE_SIZES, lambda size: size * size),
+    Benchmark("feature_table", _feature_table, IMAGE_SIZES, lambda size: size * size),
+    Benchmark("generate_from_single_image", _single_image, IMAGE_SIZES, lambda size: size * size),
+    Benchmark("generate_from_image_diff", _image_diff, IMAGE_SIZES, lambda size: size * size),
+    # Scaling of tiled labelling with the number of threads, against ndimage.label
+    Benchmark("label", _label, LABEL_SIZES, lambda size: size * size),
+    Benchmark("label_tiled_1", _label_tiled(1), LABEL_SIZES, lambda size: size * size),
+    Benchmark("label_tiled", _label_tiled(None), LABEL_SIZES, lambda size: size * size),
+    Benchmark("decode", _decode, IMAGE_SIZES, lambda size: size * size),
+    Benchmark("series_segments", _series_segments, SERIES_SIZES, lambda size: 1000),
+    Benchmark("series_regression", _series_regression, SERIES_SIZES, lambda size: size),
+    Benchmark("component_evaluator", _components, SERIES_SIZES, lambda size: size),
+]
+
+
+def run(benchmarks=None, sizes=None, repeat=3, output=None, log=print):
+    """
+    Run benchmarks across their sizes.
+    :param benchmarks: names of the benchmarks to run. None runs all.
+    :param sizes: number of sizes per benchmark, smallest first. None runs all sizes.
+    :param repeat: number of timed calls per size
+    :param output: JSON file to write the results to
+    :param log: function of a line of progress output
+    :return: results
+    """
+    results = []
+    for benchmark in BENCHMARKS:
+        if benchmarks is not None and benchmark.name not in benchmarks:
+            continue
+        for size in benchmark.sizes[:sizes]:
+            result = benchmark.run(size, repeat)
+            log("{name:28s} {size:>8d} {seconds:10.6f} s {throughput:14.1f} /s {peak_bytes:>12d} B".format(**result))
+            results.append(result)
+    report = {"python": platform.python_version(), "numpy": np.__version__, "cpus": os.cpu_count(),
+              "results": results}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Compare results against a baseline. A regression is a time or peak memory more than
+    tolerance above the baseline for the same benchmark and size.
+    :param baseline: baseline report
+    :param current: current report
+    :param tolerance: relative tolerance
+    :return: list of (name, size, metric, baseline value, current value) regressions
+    """
+    reference = {(r["name"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        base = reference.get((result["name"], result["size"]))
+        if base is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append((result["name"], result["size"], metric, base[metric], result[metric]))
+    return regressions
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from explorer_util.datasource import DataSource, DataDecoder
+from explorer_util.instrumentation import timed
+
+
+class DecodedImageCache(object):
+    """
+    Cache of decoded images, keyed by a content hash of the encoded buffer and the decoding
+    options.
+
+    Decoded arrays are kept in a least recently used in-memory tier bounded by max_bytes. If a
+    directory is given, decoded arrays are also written there as .npy files, which are memory
+    mapped when found on a later miss in memory. Cached arrays are read-only.
+
+    The cache can be shared by threads, and the directory by processes. Decoding is done outside
+    the lock, so threads that miss the same key concurrently may each decode it.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return "DecodedImageCache ({} entries, {} bytes)".format(len(self._entries), self.nbytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Cache counters
+        :return: dictionary of hits, disk_hits, misses, evictions, entries and bytes
+        """
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self._entries), "bytes": self.nbytes}
+
+    @staticmethod
+    def key(buf: bytes, mode=None, dtype=np.float32, reduce=None):
+        """
+        Cache key of a buffer and decoding options
+        :return: key
+        """
+        digest = hashlib.blake2b(buf, digest_size=20).hexdigest()
+        return "{}-{}-{}-{}".format(digest, mode, np.dtype(dtype).name, reduce)
+
+    @timed("cache.decode")
+    def decode(self, buf: bytes, mode=None, dtype=np.float32, reduce=None):
+        """
+        Decode an image buffer, or return the cached array.
+        :param buf: memory buffer with image data
+        :return: read-only array of image pixel data
+        """
+        key = self.key(buf, mode, dtype, reduce)
+        with self._lock:
+            array = self._entries.get(key)
+            if array is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return array
+        path = os.path.join(self.directory, key + ".npy") if self.directory is not None else None
+        if path is not None and os.path.exists(path):
+            array = np.load(path, mmap_mode="r")
+            counter = "disk_hits"
+        else:
+            array = DataDecoder(buf, mode, dtype, reduce).decode()
+            array.flags.writeable = False
+            counter = "misses"
+            if path is not None:
+                _save_atomic(path, array)
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self._store(key, array)
+        return array
+
+    def read_and_decode(self, file, mode=None, dtype=np.float32, reduce=None):
+        """
+        Read and decode an image file, or return the cached array.
+        :param file: file to be read
+        :return: read-only array of image pixel data
+        """
+        return self.decode(DataSource.read_from_file_source(file), mode, dtype, reduce)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _store(self, key, array):
+        # Called with the lock held
+        if array.nbytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = array
+        self.nbytes += array.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+
+class CachedDecoder(DataDecoder):
+    """
+    Data decoder that decodes through a DecodedImageCache. The callback is applied to the data
+    before the cache lookup.
+    """
+
+    def __init__(self, data, cache, mode=None, dtype=np.float32, reduce=None):
+        super().__init__(data, mode, dtype, reduce)
+        self.cache = cache
+
+    def decode(self, callback=None):
+        data = callback(self.data) if callback is not None else self.data
+        return self.cache.decode(data, self.mode, self.dtype, self.reduce)
+
+
+def _save_atomic(path, array):
+    # A unique temporary file per writer, so that concurrent writers of a key never publish a
+    # partially written file.
+    descriptor, temporary = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            np.save(f, array)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
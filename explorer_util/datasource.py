@@ -1,10 +1,16 @@
-import requests
+# requests, PIL and openpyxl are imported where they are used, to keep the import of this
+# module fast for processes that do not fetch, decode or read workbooks.
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import time
 import numpy as np
-from PIL import Image as pilimage
 from io import BytesIO
 import base64
-from numpy import genfromtxt
-from openpyxl import load_workbook
+from functools import partial
+from itertools import islice
+import struct
+from explorer_util.instrumentation import timed, nbytes as _nbytes
 
 
 class DataSource(object):
@@ -15,9 +21,24 @@ class DataSource(object):
     def __init__(self, source=None, source_type=None):
         self.source = source
 
-    def load(self, filename):
-        data = genfromtxt(filename, delimiter=',')
-        return data
+    def load(self, filename, usecols=None, dtype=np.float64, chunk_rows=100000, skiprows=0):
+        """
+        Load a CSV file, or memory map a .npy file, e.g. one written by CsvReader.to_npy.
+
+        As with numpy.genfromtxt, CSV fields that are empty or not numeric, e.g. a header row that
+        is not skipped, are loaded as NaN, and the result is squeezed, so a single column or row
+        gives a 1-D array. Files with such fields are parsed more slowly, and need a float dtype.
+        :param filename: file to be loaded
+        :param usecols: indices of the CSV columns to load. None loads all columns.
+        :param dtype: dtype of the loaded CSV data
+        :param chunk_rows: number of CSV rows parsed at a time
+        :param skiprows: number of CSV lines to skip, e.g. a header
+        :return: array
+        """
+        if str(filename).endswith(".npy"):
+            return np.load(filename, mmap_mode="r")
+        return np.squeeze(CsvReader(filename, usecols=usecols, dtype=dtype, chunk_rows=chunk_rows,
+                                    skiprows=skiprows).read())
 
     @staticmethod
     def read_from_file_source(file, nbytes=None):
@@ -41,18 +62,157 @@ class DataSource(object):
         :param url: url
         :return: contents of online source
         """
+        import requests
         response = requests.get(url)
         return response.content
 
+    @staticmethod
+    def fetch_many(urls, callback=None, concurrency=8, timeout=10, retries=2, return_exceptions=False):
+        """
+        Read from many online sources concurrently, over a session with a connection pool sized
+        to the concurrency. Response bodies are streamed into memory and passed to the callback as
+        bytes, e.g. to decode_image_to_array. At most twice the concurrency of urls are in flight,
+        and an error stops the remaining fetches unless return_exceptions is set.
+        :param urls: urls, consumed lazily
+        :param callback: function of the contents. If None, the contents are returned as bytes.
+        :param concurrency: maximum number of concurrent requests
+        :param timeout: connect and read timeout in seconds
+        :param retries: number of retries on connection errors and 429/5xx responses
+        :param return_exceptions: return exceptions as results instead of raising them
+        :return: iterator of (url, result) tuples, in the order of urls
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.1, status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        def fetch(url):
+            try:
+                return url, _fetch_streamed(session, url, callback, timeout)
+            except Exception as error:
+                if not return_exceptions:
+                    raise
+                return url, error
+
+        with session, ThreadPoolExecutor(concurrency) as executor:
+            pending = deque()
+            try:
+                for url in urls:
+                    if len(pending) >= 2 * concurrency:
+                        yield pending.popleft().result()
+                    pending.append(executor.submit(fetch, url))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class CsvReader(object):
+    """
+    Reads a numeric CSV file in chunks of rows, using the numpy C parser on each chunk. Memory is
+    bounded by the chunk size when iterating. For a float dtype, a chunk with empty or non-numeric
+    fields is parsed again field by field, with those fields read as missing, NaN by default.
+
+    The number of rows and the seconds spent reading are accumulated in rows and seconds.
+    """
+
+    def __init__(self, filename, delimiter=",", usecols=None, dtype=np.float64, chunk_rows=100000, skiprows=0,
+                 missing=np.nan):
+        self.filename = filename
+        self.delimiter = delimiter
+        self.usecols = usecols
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self.skiprows = skiprows
+        self.missing = missing
+        self.rows = 0
+        self.seconds = 0.
+
+    def __repr__(self):
+        return "CsvReader ({}, {} rows)".format(self.filename, self.rows)
+
+    def __iter__(self):
+        """
+        Iterate over the file in chunks.
+        :return: iterator of 2-D arrays with at most chunk_rows rows
+        """
+        with open(self.filename, "r") as f:
+            lines = islice(f, self.skiprows, None)
+            while True:
+                start = time.perf_counter()
+                chunk = list(islice(lines, self.chunk_rows))
+                if not chunk:
+                    break
+                array = self._parse(chunk)
+                self.seconds += time.perf_counter() - start
+                self.rows += array.shape[0]
+                yield array
+
+    def _parse(self, chunk):
+        try:
+            return np.loadtxt(chunk, delimiter=self.delimiter, usecols=self.usecols, dtype=self.dtype, ndmin=2)
+        except ValueError:
+            if self.dtype.kind != "f":
+                raise
+        return np.loadtxt(chunk, delimiter=self.delimiter, usecols=self.usecols, dtype=self.dtype, ndmin=2,
+                          converters=partial(_parse_float, missing=self.missing))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.
+
+    def read(self):
+        """
+        Read the whole file.
+        :return: 2-D array
+        """
+        chunks = list(self)
+        if not chunks:
+            return np.empty((0, 0), dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    def to_npy(self, path):
+        """
+        Convert the file to a .npy file chunk by chunk. Load it with DataSource.load, which
+        memory maps it. The array is squeezed as DataSource.load squeezes CSV data, so a single
+        column gives a 1-D array either way.
+        :param path: .npy file to write
+        :return: shape of the converted data
+        """
+        rows, columns = 0, 0
+        with open(path, "wb") as f:
+            _write_npy_header(f, self.dtype, (0, 0))
+            for chunk in self:
+                f.write(np.ascontiguousarray(chunk).tobytes())
+                rows += chunk.shape[0]
+                columns = chunk.shape[1]
+            f.seek(0)
+            shape = tuple(length for length in (rows, columns) if length != 1)
+            _write_npy_header(f, self.dtype, shape)
+        return shape
+
 
 class DataDecoder(object):
     """
     Data decoder
+
+    The image decoding options are those of decode_image_to_array. By default images are
+    decoded to float32 arrays with all color channels.
     """
 
-    def __init__(self, data):
+    def __init__(self, data, mode=None, dtype=np.float32, reduce=None):
         self.data = data
+        self.mode = mode
+        self.dtype = dtype
+        self.reduce = reduce
 
+    @timed("datasource.decode")
     def decode(self, callback=None):
         """
         Decode data stream. If callback is None, the delegator will determine the callback method.
@@ -62,18 +222,28 @@ class DataDecoder(object):
         runner = CallbackRunner(input=self.data)
         if callback is not None:
             runner.add(callback)
-        return runner.add(decode_image_to_array).run()
+        return runner.add(partial(decode_image_to_array, mode=self.mode, dtype=self.dtype, reduce=self.reduce)).run()
 
     def inspect(self, buffer=None):
         """
-        inspect buffer to determine data format
-        :return:
+        inspect buffer to determine data format. Only the image header is read.
+        :param buffer: buffer to inspect. Defaults to the data of the decoder.
+        :return: tuple of format, size (width, height) and mode of the image
         """
-        raise NotImplementedError("inspect() API method not yet implemented")
+        return _process_data_buffer(self.data if buffer is None else buffer, _inspect_image)
 
 
-def decode_image_to_array(buf: bytes):
-    return _process_data_buffer(buf, _decode_image_to_array)
+def decode_image_to_array(buf: bytes, mode=None, dtype=np.float32, reduce=None):
+    """
+    Decode an image buffer to an array.
+    :param buf: memory buffer with image data
+    :param mode: PIL image mode to decode to, e.g. "L" for single-channel grayscale. None keeps the
+        mode of the image.
+    :param dtype: dtype of the array, e.g. numpy.uint8, numpy.uint16 or numpy.float32
+    :param reduce: integer downscaling factor. JPEG images are downscaled while decoding.
+    :return: array of image pixel data
+    """
+    return _process_data_buffer(buf, partial(_decode_image_to_array, mode=mode, dtype=dtype, reduce=reduce))
 
 
 def base64_decode(data):
@@ -81,48 +251,246 @@ def base64_decode(data):
 
 
 class CallbackRunner(object):
+    """
+    Runs a chain of callbacks, the stages, on a single input with run(), or lazily on an
+    iterable of inputs with stream(). The wall time, item count and output bytes of each stage
+    are recorded in stats.
+    """
 
     def __init__(self, input=None, callback=None):
         self.data = input
         self.callbacks = [callback] if callback is not None else []
+        self.workers = [None] * len(self.callbacks)
+        self.stats = []
 
-    def add(self, cb):
+    def add(self, cb, workers=None):
+        """
+        Add a stage.
+        :param cb: callback
+        :param workers: number of threads to run the stage on when streaming. None runs the stage
+            in the consuming thread.
+        :return: the runner
+        """
         self.callbacks.append(cb)
+        self.workers.append(workers)
         return self
 
     def run(self):
         if self.data is not None:
+            self.stats = [StageStats(f) for f in self.callbacks]
             processed_data = self.data
-            for f in self.callbacks:
-                processed_data = f(processed_data)
+            for f, stats in zip(self.callbacks, self.stats):
+                processed_data = stats.call(f, processed_data)
             return processed_data
 
+    def stream(self, inputs, queue_size=8):
+        """
+        Run the stages lazily on an iterable of inputs. Results are yielded in input order.
+        :param inputs: iterable of inputs
+        :param queue_size: maximum number of items in flight in a threaded stage
+        :return: iterator of results
+        """
+        self.stats = [StageStats(f) for f in self.callbacks]
+        items = iter(inputs)
+        for f, workers, stats in zip(self.callbacks, self.workers, self.stats):
+            if workers is None:
+                items = _run_stage(f, items, stats)
+            else:
+                items = _run_threaded_stage(f, items, stats, workers, max(queue_size, workers))
+        return items
+
+    def report(self):
+        """
+        Stage statistics, slowest stage first.
+        :return: list of StageStats
+        """
+        return sorted(self.stats, key=lambda s: s.seconds, reverse=True)
+
+
+class StageStats(object):
+    """
+    Wall time, item count and output bytes of a stage. For threaded stages, seconds is the time
+    summed over the threads.
+    """
+
+    def __init__(self, callback):
+        self.name = _callback_name(callback)
+        self.seconds = 0.
+        self.items = 0
+        self.nbytes = 0
+        self._lock = threading.Lock()
 
-def get_columns_from_xlsx_workbook(wb):
-    allrows = np.array([row for row in wb.active.iter_rows(min_row=2, max_col=2, max_row=50, values_only=True)])
-    return np.array([i for i in allrows if i[0] is not None])
+    def __repr__(self):
+        return "{}: {} items, {:.6f} s, {} bytes".format(self.name, self.items, self.seconds, self.nbytes)
 
+    def call(self, callback, item):
+        start = time.perf_counter()
+        result = callback(item)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.seconds += elapsed
+            self.items += 1
+            self.nbytes += _nbytes(result)
+        return result
 
-def load_excel_doc_from_buf(buf: bytes):
+
+def _run_stage(callback, items, stats):
+    for item in items:
+        yield stats.call(callback, item)
+
+
+def _run_threaded_stage(callback, items, stats, workers, queue_size):
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+            pending.append(executor.submit(stats.call, callback, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def _callback_name(callback):
+    if isinstance(callback, partial):
+        callback = callback.func
+    return getattr(callback, "__name__", repr(callback))
+
+
+def get_columns_from_xlsx_workbook(wb, columns=(1, 2), min_row=2, max_row=None, sheet=None):
+    """
+    Read columns of a worksheet into a 2-D object array. Rows with an empty first column are skipped.
+    :param wb: workbook
+    :param columns: 1-based indices of the columns to read
+    :param min_row: first row to read, 1-based
+    :param max_row: last row to read. None reads to the end of the sheet.
+    :param sheet: name of the worksheet. None reads the active worksheet.
+    :return: array with a column per selected column
+    """
+    arrays = read_xlsx_columns(wb, columns, min_row=min_row, max_row=max_row, sheet=sheet)
+    return np.array(arrays, dtype=object).T
+
+
+def read_xlsx_columns(wb, columns=(1, 2), dtypes=None, min_row=2, max_row=None, sheet=None, block_rows=4096):
+    """
+    Read columns of a worksheet into typed arrays, block by block. Use a workbook loaded with
+    read_only=True to stream the rows. Rows with an empty first column are skipped.
+    :param wb: workbook
+    :param columns: 1-based indices of the columns to read
+    :param dtypes: dtype per column, e.g. "datetime64[s]" or numpy.float64. None reads objects.
+    :param min_row: first row to read, 1-based
+    :param max_row: last row to read. None reads to the end of the sheet.
+    :param sheet: name of the worksheet. None reads the active worksheet.
+    :param block_rows: number of rows read per block
+    :return: list of 1-D arrays, one per column
+    """
+    worksheet = wb.active if sheet is None else wb[sheet]
+    dtypes = [object] * len(columns) if dtypes is None else dtypes
+    offsets = [column - min(columns) for column in columns]
+    # Sized to the rows to read if the sheet reports its size, and grown by doubling otherwise
+    last = worksheet.max_row
+    if max_row is not None:
+        last = max_row if last is None else min(max_row, last)
+    capacity = max(last - min_row + 1, 0) if last is not None else block_rows
+    arrays = [np.empty(capacity, dtype=dtype) for dtype in dtypes]
+    rows = worksheet.iter_rows(min_row=min_row, max_row=max_row, min_col=min(columns), max_col=max(columns),
+                               values_only=True)
+    count = 0
+    while True:
+        block = list(islice(rows, block_rows))
+        if not block:
+            break
+        block = [row for row in block if row[offsets[0]] is not None]
+        if count + len(block) > capacity:
+            capacity = max(2 * capacity, count + len(block))
+            arrays = [np.resize(array, capacity) for array in arrays]
+        for array, offset in zip(arrays, offsets):
+            array[count:count + len(block)] = [row[offset] for row in block]
+        count += len(block)
+    return [array[:count] for array in arrays]
+
+
+def load_excel_doc_from_buf(buf: bytes, read_only=False):
+    """
+    Load a workbook from a buffer.
+    :param buf: memory buffer with the workbook
+    :param read_only: load the workbook in openpyxl's read-only mode, which reads rows lazily.
+        Close the workbook when done.
+    :return: workbook
+    """
+    if read_only:
+        from openpyxl import load_workbook
+        # The workbook reads from the stream until it is closed.
+        return load_workbook(BytesIO(buf), read_only=True)
     return _process_data_buffer(buf, _load_excel_doc_from_buf)
 
 
-def _decode_image_to_array(bytesio: BytesIO):
+def _decode_image_to_array(bytesio: BytesIO, mode=None, dtype=np.float32, reduce=None):
     """
     Image decoder
     :param buf: memory buffer with image data
     :type buf:
+    :param mode: PIL image mode to decode to
+    :param dtype: dtype of the array
+    :param reduce: integer downscaling factor
     :return: array [width, height, cc] of image pixel data, with cc: colorchannels.
     :rtype: numpy.ndarray
     """
+    from PIL import Image as pilimage
+    image_object = pilimage.open(bytesio, mode="r")
+    width, height = image_object.size
+    reduce = reduce if reduce is not None and reduce > 1 else None
+    size = (-(-width // reduce), -(-height // reduce)) if reduce is not None else None
+    if mode is not None or reduce is not None:
+        # Selects a reduced scale and mode in the JPEG decoder. A no-op for other formats.
+        image_object.draft(mode, size)
+    if mode is not None and image_object.mode != mode:
+        image_object = image_object.convert(mode)
+    if reduce is not None and image_object.size != size:
+        try:
+            if image_object.size != (width, height):
+                raise ValueError("Image partially reduced by the decoder")
+            image_object = image_object.reduce(reduce)
+        except ValueError:
+            # Modes that Image.reduce does not support, e.g. I;16, P and 1
+            image_object = image_object.resize(size, pilimage.BOX)
+    return np.array(image_object, dtype=dtype)
+
+
+def _inspect_image(bytesio: BytesIO):
+    from PIL import Image as pilimage
     image_object = pilimage.open(bytesio, mode="r")
-    return np.array(image_object).astype(np.float32)
+    return image_object.format, image_object.size, image_object.mode
 
 
 def _load_excel_doc_from_buf(bytesio: BytesIO):
+    from openpyxl import load_workbook
     return load_workbook(bytesio)
 
 
+def _fetch_streamed(session, url, callback, timeout):
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        with BytesIO() as memory_stream:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                memory_stream.write(chunk)
+            content = memory_stream.getvalue()
+    return content if callback is None else callback(content)
+
+
+def _parse_float(field, missing=np.nan):
+    try:
+        return float(field)
+    except ValueError:
+        return missing
+
+
+def _write_npy_header(f, dtype, shape, size=128):
+    # Fixed-size header, so that it can be rewritten with the final shape after the data.
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+    header = header.ljust(size - 11) + "\n"
+    f.write(np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+
 def _process_data_buffer(buf: bytes, func):
     memory_stream = BytesIO(buf)
     try:
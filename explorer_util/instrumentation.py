@@ -0,0 +1,162 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import numpy as np
+
+
+# Instrumentation is disabled unless a sink is attached, and instrumented functions then only
+# check this flag.
+enabled = False
+
+_sinks = []
+_lock = threading.Lock()
+
+
+class MemorySink(object):
+    """
+    Keeps the recorded values in memory, per name and metric.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "MemorySink ({} series)".format(len(self.values))
+
+    def record(self, name, metric, value):
+        with self._lock:
+            self.values.setdefault((name, metric), []).append(value)
+
+    def percentiles(self, name, metric="seconds", q=(50, 90, 99)):
+        """
+        Percentiles of the recorded values.
+        :return: dictionary of percentile to value
+        """
+        values = self.values.get((name, metric), [])
+        if not values:
+            return {}
+        return dict(zip(q, np.percentile(values, q)))
+
+    def summary(self):
+        """
+        Count, total and median, 90th and 99th percentiles per name and metric.
+        :return: dictionary keyed by (name, metric)
+        """
+        return {key: {"count": len(values), "total": float(np.sum(values)),
+                      "p50": float(np.percentile(values, 50)), "p90": float(np.percentile(values, 90)),
+                      "p99": float(np.percentile(values, 99))}
+                for key, values in self.values.items()}
+
+
+class LoggingSink(object):
+    """
+    Writes the recorded values to a logger.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = level
+
+    def record(self, name, metric, value):
+        self.logger.log(self.level, "%s %s %s", name, metric, value)
+
+
+class JsonLinesSink(object):
+    """
+    Writes the recorded values as JSON lines to a file or stream.
+    """
+
+    def __init__(self, file):
+        self._owned = isinstance(file, str)
+        self.stream = open(file, "a") if self._owned else file
+        self._lock = threading.Lock()
+
+    def record(self, name, metric, value):
+        line = json.dumps({"time": time.time(), "name": name, "metric": metric, "value": value})
+        with self._lock:
+            self.stream.write(line + "\n")
+
+    def close(self):
+        if self._owned:
+            self.stream.close()
+
+
+def add_sink(sink):
+    """
+    Attach a sink and enable instrumentation.
+    """
+    global enabled
+    with _lock:
+        _sinks.append(sink)
+        enabled = True
+
+
+def remove_sink(sink):
+    """
+    Detach a sink. Instrumentation is disabled when no sinks remain.
+    """
+    global enabled
+    with _lock:
+        _sinks.remove(sink)
+        enabled = len(_sinks) > 0
+
+
+@contextmanager
+def profile(sink=None):
+    """
+    Enable instrumentation within a scope.
+    :param sink: sink to record to. Defaults to a new MemorySink.
+    :return: the sink
+    """
+    sink = MemorySink() if sink is None else sink
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+
+
+def record(name, metric, value):
+    """
+    Record a value, e.g. a count or a number of bytes, if instrumentation is enabled.
+    """
+    if enabled:
+        for sink in list(_sinks):
+            sink.record(name, metric, value)
+
+
+def timed(name):
+    """
+    Decorator recording the wall time in seconds and the output bytes of each call of the
+    decorated function, if instrumentation is enabled.
+    :param name: name to record under
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            record(name, "seconds", time.perf_counter() - start)
+            record(name, "bytes", nbytes(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def nbytes(data):
+    """
+    Number of bytes of an array, a bytes-like object, or a tuple or list of these.
+    """
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    if isinstance(data, (tuple, list)):
+        return sum(nbytes(item) for item in data)
+    return 0
@@ -1,11 +1,16 @@
 import numpy as np
-from matplotlib import pyplot as pl
+from sequence.decimation import decimate, decimate_points
 
 
-def plot_lin_eq(data, components):
+def plot_lin_eq(data, components, decimation=True):
     p1, p2 = get_linear_edge(components[0])
     p3, p4 = get_linear_edge(components[1])
+    from matplotlib import pyplot as pl
     figure, axes = pl.subplots()
+    if decimation:
+        width, height = _pixel_size(axes)
+        indices = decimate_points(data[0], data[1], width, height)
+        data = (np.asarray(data[0])[indices], np.asarray(data[1])[indices])
     axes.set_xlabel("$X_1$")
     axes.set_ylabel("$X_2$")
     axes.set_aspect('equal')
@@ -15,6 +20,35 @@ def plot_lin_eq(data, components):
     return figure, axes
 
 
+def plot_series(series, axes=None, method='minmax', decimation=True):
+    """
+    Plot a series, decimated to the pixel width of the axes.
+    :param series: series
+    :type series: sequence.discrete.Series
+    :param axes: axes to plot in. Creates a figure if None.
+    :param method: decimation method, 'minmax' or 'lttb'
+    :param decimation: decimate the series
+    :return: figure and axes
+    """
+    if axes is None:
+        from matplotlib import pyplot as pl
+        figure, axes = pl.subplots()
+    else:
+        figure = axes.figure
+    if decimation:
+        width, _ = _pixel_size(axes)
+        indices = decimate(series.epoch_seconds(), series.values, width, method)
+        axes.plot(series.time[indices], series.values[indices], "-", color="gray")
+    else:
+        axes.plot(series.time, series.values, "-", color="gray")
+    return figure, axes
+
+
+def _pixel_size(axes):
+    extent = axes.get_window_extent()
+    return max(int(extent.width), 1), max(int(extent.height), 1)
+
+
 def get_linear_edge(component):
     theta = np.arctan(component.v[1] / component.v[0])
     delta_y = component.length * np.sin(theta)
@@ -27,6 +61,7 @@ def get_linear_edge(component):
 
 
 def plot_image_with_annotation(img, x, y):
+    from matplotlib import pyplot as pl
     fig, ax = pl.subplots()
     ax.imshow(img, cmap='gray')
     ax.scatter(x, y, s=40, c='b', marker='o', )
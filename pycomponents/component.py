@@ -1,5 +1,9 @@
 import numpy as np
 from numpy import linalg
+from explorer_util.instrumentation import timed
+
+
+SOLVERS = ('eig', 'eigh', 'svd', 'randomized')
 
 
 class Component(object):
@@ -13,30 +17,199 @@ class Component(object):
         return "center: {0}, length: {1}, direction: {2}".format(self.center, self.length, self.v)
 
     @staticmethod
-    def calculate_eigenvector(data):
+    @timed("component.calculate_eigenvector")
+    def calculate_eigenvector(data, k=None, solver='eig', random_state=None):
         """
-        Calculate eigenvalues, eigenvector, and center vector of the principal components.
+        Calculate eigenvalues, eigenvector, and center vector of the principal components, sorted by
+        decreasing eigenvalue.
+
+        The solvers are 'eig', the general eigensolver on the covariance matrix, 'eigh', the
+        symmetric eigensolver on the covariance matrix, 'svd', the singular value decomposition of
+        the centered data, and 'randomized', a randomized singular value decomposition of the
+        centered data that finds only the top k components.
         :param data: The variables to calculate the eigenvector from .
+        :param k: The number of components to keep. None keeps all.
+        :param solver: The solver.
+        :param random_state: Seed of the randomized solver.
         :return: tuple of center vector, eigenvalues and eigenvector
         """
+        if solver not in SOLVERS:
+            raise ValueError("Unsupported solver " + solver)
         center_vector = np.mean(data, 0)
-        cov_mat = np.cov(data.T)
-        eigen_values, eigen_vector = linalg.eig(cov_mat)
-        return center_vector, eigen_values, eigen_vector
+        if solver in ('eig', 'eigh'):
+            cov_mat = np.cov(data.T)
+            return Component.calculate_eigenvector_from_covariance(center_vector, cov_mat, k, solver)
+        centered = np.asarray(data, dtype=np.float64) - center_vector
+        k = centered.shape[1] if k is None else k
+        if solver == 'svd':
+            _, singular_values, vt = linalg.svd(centered, full_matrices=False)
+        else:
+            singular_values, vt = _randomized_svd(centered, k, random_state)
+        eigen_values = singular_values[:k] ** 2 / (centered.shape[0] - 1)
+        return center_vector, eigen_values, vt[:k].T
+
+    @staticmethod
+    @timed("component.calculate_eigenvector_from_covariance")
+    def calculate_eigenvector_from_covariance(center_vector, cov_mat, k=None, solver='eig'):
+        """
+        Calculate eigenvalues and eigenvector of the principal components from a covariance matrix,
+        sorted by decreasing eigenvalue.
+        :param center_vector: The mean of the variables.
+        :param cov_mat: The covariance matrix of the variables.
+        :param k: The number of components to keep. None keeps all.
+        :param solver: 'eig' or 'eigh'.
+        :return: tuple of center vector, eigenvalues and eigenvector
+        """
+        if solver == 'eig':
+            eigen_values, eigen_vector = linalg.eig(cov_mat)
+        elif solver == 'eigh':
+            eigen_values, eigen_vector = linalg.eigh(cov_mat)
+        else:
+            raise ValueError("Unsupported solver for a covariance matrix " + solver)
+        order = np.argsort(-eigen_values.real, kind='stable')[:k]
+        return center_vector, eigen_values[order], eigen_vector[:, order]
+
+
+class CovarianceAccumulator(object):
+    """
+    Running count, mean and scatter matrix of observations added in chunks. Chunks are merged
+    with the pairwise update of Chan et al., which is numerically stable.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.scatter = None
+
+    def __repr__(self):
+        return "CovarianceAccumulator ({} observations)".format(self.n)
+
+    def update(self, chunk):
+        """
+        Add a chunk of observations, one row per observation.
+        :param chunk: 2-D array
+        """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        n = chunk.shape[0]
+        if n == 0:
+            return
+        mean = np.mean(chunk, 0)
+        centered = chunk - mean
+        scatter = centered.T @ centered
+        if self.n == 0:
+            self.n, self.mean, self.scatter = n, mean, scatter
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.scatter = self.scatter + scatter + np.outer(delta, delta) * (self.n * n / total)
+        self.mean = self.mean + delta * (n / total)
+        self.n = total
+
+    @property
+    def covariance(self):
+        """
+        The sample covariance matrix, as calculated by numpy.cov.
+        """
+        return self.scatter / (self.n - 1)
 
 
 class ComponentEvaluator(object):
+    """
+    Iterates over the principal components of the data, in order of decreasing variance. Use k
+    and solver to evaluate only the top components of wide data, see Component.calculate_eigenvector.
+    """
 
-    def __init__(self, data):
+    def __init__(self, data=None, k=None, solver='eig', random_state=None):
         self.component_index = 0
-        self.center_vector, self.eigen_values, self.eigen_vector = Component.calculate_eigenvector(data)
+        if data is not None:
+            self.center_vector, self.eigen_values, self.eigen_vector = \
+                Component.calculate_eigenvector(data, k, solver, random_state)
+
+    @staticmethod
+    def from_chunks(chunks, k=None, solver='eig'):
+        """
+        Evaluate the principal components of data given as an iterable of chunks of rows, e.g. a
+        CsvReader. Only one chunk is held in memory at a time.
+        :param chunks: iterable of 2-D arrays
+        :param k: The number of components to keep. None keeps all.
+        :param solver: 'eig' or 'eigh'.
+        :return: component evaluator
+        :rtype: ComponentEvaluator
+        """
+        accumulator = CovarianceAccumulator()
+        for chunk in chunks:
+            accumulator.update(chunk)
+        return ComponentEvaluator.from_accumulator(accumulator, k, solver)
+
+    @staticmethod
+    def from_accumulator(accumulator, k=None, solver='eig'):
+        """
+        Evaluate the principal components of the observations added to an accumulator.
+        :param accumulator: covariance accumulator
+        :type accumulator: CovarianceAccumulator
+        :param k: The number of components to keep. None keeps all.
+        :param solver: 'eig' or 'eigh'.
+        :return: component evaluator
+        :rtype: ComponentEvaluator
+        """
+        evaluator = ComponentEvaluator()
+        evaluator.center_vector, evaluator.eigen_values, evaluator.eigen_vector = \
+            Component.calculate_eigenvector_from_covariance(accumulator.mean, accumulator.covariance, k, solver)
+        return evaluator
 
     def __iter__(self):
         return self
 
     def __next__(self):
         index = self.component_index
-        if self.component_index >= self.eigen_vector.shape[0]:
+        if self.component_index >= self.eigen_vector.shape[1]:
             raise StopIteration
         self.component_index += 1
         return Component(self.center_vector, np.sqrt(self.eigen_values[index]), self.eigen_vector.T[index])
+
+
+def eigen_2x2(a, b, c):
+    """
+    Closed-form eigen decomposition of symmetric 2x2 matrices [[a, c], [c, b]], for arrays of
+    matrices.
+    :param a: array of the first diagonal elements
+    :param b: array of the second diagonal elements
+    :param c: array of the off-diagonal elements
+    :return: tuple of the largest eigenvalues, the smallest eigenvalues, and the unit eigenvectors
+        (..., 2) of the largest eigenvalues. The other eigenvectors are perpendicular to these.
+    """
+    a, b, c = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64), np.asarray(c, dtype=np.float64)
+    half_trace = 0.5 * (a + b)
+    root = 0.5 * np.hypot(a - b, 2 * c)
+    # Isotropic matrices (a == b, c == 0) get the first axis as direction.
+    theta = 0.5 * np.arctan2(2 * c, a - b)
+    return half_trace + root, np.maximum(half_trace - root, 0.), np.stack((np.cos(theta), np.sin(theta)), -1)
+
+
+def principal_components_2d(points):
+    """
+    Principal components of a stack of 2-D point sets, in one pass with the closed-form 2x2 eigen
+    decomposition.
+    :param points: array (..., n, 2) of point sets with n points each
+    :return: tuple of center vectors (..., 2), eigenvalues (..., 2) in decreasing order, and
+        eigenvectors (..., 2, 2) as columns
+    """
+    points = np.asarray(points, dtype=np.float64)
+    center_vector = np.mean(points, -2)
+    centered = points - center_vector[..., np.newaxis, :]
+    cov_mat = np.einsum('...ni,...nj->...ij', centered, centered) / (points.shape[-2] - 1)
+    emax, emin, vmax = eigen_2x2(cov_mat[..., 0, 0], cov_mat[..., 1, 1], cov_mat[..., 0, 1])
+    eigen_vector = np.stack((vmax, np.stack((-vmax[..., 1], vmax[..., 0]), -1)), -1)
+    return center_vector, np.stack((emax, emin), -1), eigen_vector
+
+
+def _randomized_svd(centered, k, random_state=None, oversamples=10, iterations=4):
+    # Randomized range finder with power iterations (Halko, Martinsson and Tropp, 2011).
+    rng = np.random.default_rng(random_state)
+    omega = rng.standard_normal((centered.shape[1], min(k + oversamples, min(centered.shape))))
+    q, _ = linalg.qr(centered @ omega)
+    for _ in range(iterations):
+        q, _ = linalg.qr(centered.T @ q)
+        q, _ = linalg.qr(centered @ q)
+    _, singular_values, vt = linalg.svd(q.T @ centered, full_matrices=False)
+    return singular_values, vt
@@ -0,0 +1,89 @@
+import numpy as np
+from scipy import ndimage
+from pyspatialfield.field.featuretable import FeatureTable
+
+
+class BackgroundSubtractor(object):
+    """
+    Detects features in a sequence of frames by the pixel value difference between each frame
+    and a running background model.
+
+    The background model is either an exponential moving average ('ema') of the frames, or the
+    median of the last window frames ('median'). Grayscale conversion, differencing,
+    thresholding and labelling write into buffers allocated on the first frame, so the label
+    map returned for a frame is overwritten by the next frame.
+    """
+
+    def __init__(self, threshold=10, method='ema', alpha=0.05, window=15):
+        if method not in ('ema', 'median'):
+            raise ValueError("Unsupported method " + method)
+        self.threshold = threshold
+        self.method = method
+        self.alpha = alpha
+        self.window = window
+        self.background = None
+        self.frame_count = 0
+
+    def __repr__(self):
+        return "BackgroundSubtractor ({}, {} frames)".format(self.method, self.frame_count)
+
+    def run(self, frames):
+        """
+        Processes a sequence of frames.
+
+        :param frames: iterable of 2-D grayscale or 3-D color frames of equal size
+        :return: iterator of (label map, feature table) tuples, one per frame
+        :rtype: iterator
+        """
+        for frame in frames:
+            yield self.apply(frame)
+
+    def apply(self, frame):
+        """
+        Labels the features of a frame against the current background model, then updates the
+        background model with the frame.
+
+        :param frame: 2-D grayscale or 3-D color frame
+        :type frame: numpy.ndarray
+        :return: tuple of label map and feature table
+        :rtype: tuple
+        """
+        if self.background is None:
+            self._allocate(frame.shape[:2])
+        gray = self._gray
+        if frame.ndim == 3:
+            np.mean(frame, 2, out=gray)
+        else:
+            np.copyto(gray, frame, casting='unsafe')
+        if self.frame_count == 0:
+            self.background[:] = gray
+            self._history[:] = gray
+        np.subtract(gray, self.background, out=self._diff)
+        np.abs(self._diff, out=self._diff)
+        np.greater_equal(self._diff, self.threshold, out=self._mask)
+        ndimage.label(self._mask, output=self._labels)
+        table = FeatureTable.from_labelmap(self._labels)
+        self._update(gray)
+        self.frame_count += 1
+        return self._labels, table
+
+    def _allocate(self, shape):
+        self.background = np.empty(shape, dtype=np.float32)
+        self._gray = np.empty(shape, dtype=np.float32)
+        self._diff = np.empty(shape, dtype=np.float32)
+        self._mask = np.empty(shape, dtype=bool)
+        self._labels = np.empty(shape, dtype=np.int32)
+        history = self.window if self.method == 'median' else 0
+        self._history = np.empty((history,) + shape, dtype=np.float32)
+        # The median partitions its input in place, so it runs on a copy of the history
+        self._scratch = np.empty_like(self._history)
+
+    def _update(self, gray):
+        if self.method == 'ema':
+            np.subtract(gray, self.background, out=self._diff)
+            np.multiply(self._diff, self.alpha, out=self._diff)
+            np.add(self.background, self._diff, out=self.background)
+        else:
+            self._history[self.frame_count % self.window] = gray
+            np.copyto(self._scratch, self._history)
+            np.median(self._scratch, 0, out=self.background, overwrite_input=True)
@@ -0,0 +1,88 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from explorer_util.datasource import DataSource, DataDecoder
+from pyspatialfield.field.featurefield import FeatureField
+from pyspatialfield.field.featuretable import FeatureTable
+
+
+class BatchResult(object):
+    """
+    Result of measuring the features of one file. Either table or error is set.
+    """
+
+    def __init__(self, file, table=None, error=None):
+        self.file = file
+        self.table = table
+        self.error = error
+
+    def __repr__(self):
+        if self.error is not None:
+            return "BatchResult ({}: {})".format(self.file, self.error)
+        return "BatchResult ({}: {} features)".format(self.file, len(self.table))
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def measure_file(file, threshold=50, preprocess=None):
+    """
+    Reads and decodes an image file, labels it, and measures the features.
+
+    :param file: image file
+    :param threshold: Pixel intensity threshold
+    :param preprocess: Preprocessor function
+    :return: feature table
+    :rtype: FeatureTable
+    """
+    decoder = DataDecoder(DataSource.read_from_file_source(file))
+    _, labeled_map = FeatureField.generate_from_single_image(decoder, threshold, preprocess)
+    return FeatureTable.from_labelmap(labeled_map)
+
+
+def run_batch(files, threshold=50, preprocess=None, processes=None, max_in_flight=None, ordered=True):
+    """
+    Measures the features of image files on a process pool. The workers return feature tables,
+    not images, and errors are captured per file.
+
+    :param files: iterable of image files, consumed lazily
+    :param threshold: Pixel intensity threshold
+    :param preprocess: Preprocessor function. Must be picklable.
+    :param processes: number of worker processes. Defaults to the number of CPUs.
+    :type processes: int
+    :param max_in_flight: maximum number of submitted, unfinished files. Defaults to twice the
+        number of processes.
+    :type max_in_flight: int
+    :param ordered: yield results in the order of files, or as they complete
+    :type ordered: bool
+    :return: iterator of results
+    :rtype: iterator of BatchResult
+    """
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * processes
+    with ProcessPoolExecutor(processes) as executor:
+        pending = deque()
+        for file in files:
+            if len(pending) >= max_in_flight:
+                yield from _collect(pending, ordered)
+            pending.append(executor.submit(_measure_file_safe, file, threshold, preprocess))
+        while pending:
+            yield from _collect(pending, ordered)
+
+
+def _collect(pending, ordered):
+    if ordered:
+        yield pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def _measure_file_safe(file, threshold, preprocess):
+    try:
+        return BatchResult(file, table=measure_file(file, threshold, preprocess))
+    except Exception as error:
+        return BatchResult(file, error="{}: {}".format(type(error).__name__, error))
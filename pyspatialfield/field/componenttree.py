@@ -0,0 +1,225 @@
+import numpy as np
+from pyspatialfield.field.featuretable import FeatureTable
+from pyspatialfield.field.labeling import graph_components
+
+
+class ComponentTree(object):
+    """
+    Max-tree of an image: the connected components of image > threshold for every threshold,
+    built once by processing the pixels in order of decreasing value and merging components with
+    union-find.
+
+    Each node is a component at the level at which it was formed, and keeps the raw moments of
+    all its pixels, so label maps, areas and moments for any threshold are answered from the tree
+    without labelling the image again. The connectivity matches scipy.ndimage.label: 1 for
+    edge-connected (the default of ndimage.label), 2 for edge and corner connected pixels.
+
+    The levels are processed one after another, each with array operations over its pixels, so
+    the build cost grows with the number of levels. If thresholds are given, the image is
+    quantized to them, and only those thresholds can be queried. Otherwise every distinct pixel
+    value is a level, and images with more than max_levels distinct values, e.g. most float
+    images, are rejected rather than built slowly.
+    """
+
+    def __init__(self, image, thresholds=None, connectivity=1, max_levels=4096):
+        image = np.asarray(image)
+        if isinstance(thresholds, (int, np.integer)):
+            thresholds = np.linspace(np.min(image), np.max(image), thresholds)
+        if thresholds is None:
+            self.levels = np.unique(image)
+            self.exact = False
+            if len(self.levels) > max_levels:
+                raise ValueError("Image has {} distinct values, more than max_levels {}. Pass thresholds to "
+                                 "quantize it".format(len(self.levels), max_levels))
+        else:
+            self.levels = np.unique(np.asarray(thresholds))
+            self.exact = True
+        self.shape = image.shape
+        self.connectivity = connectivity
+        self._build(np.searchsorted(self.levels, image, side='left').ravel(), image.shape[1])
+
+    def __repr__(self):
+        return "ComponentTree ({} nodes, {} levels)".format(len(self.node_level), len(self.levels))
+
+    @staticmethod
+    def from_single_image(decoder, thresholds=None, preprocess=None, decoder_callback=None, connectivity=1):
+        """
+        Builds the component tree of an image from a data source, prepared as in
+        FeatureField.generate_from_single_image.
+
+        :param decoder: Decoder containing the image data.
+        :param thresholds: Pixel intensity thresholds to quantize to, or a number of evenly spaced
+            thresholds. None uses every pixel value.
+        :param preprocess: Preprocessor function
+        :param decoder_callback: Decoder callback
+        :return: component tree
+        :rtype: ComponentTree
+        """
+        img_array = decoder.decode(callback=decoder_callback)
+        if len(img_array.shape) == 3:
+            img_array = np.mean(img_array, 2)
+        array = preprocess(img_array) if preprocess is not None else img_array
+        return ComponentTree(array, thresholds, connectivity)
+
+    def labelmap(self, threshold):
+        """
+        The label map of image > threshold, with labels 1..n in the order of table(threshold).
+
+        :param threshold: Pixel intensity threshold
+        :return: map with labelled features
+        :rtype: numpy.ndarray
+        """
+        k = self._level_index(threshold)
+        representative, alive = self._representatives(k)
+        labels = np.zeros(len(self.node_level), dtype=np.int32)
+        labels[alive] = np.arange(1, len(alive) + 1)
+        map = np.zeros(self.pixel_node.size, dtype=np.int32)
+        foreground = self.pixel_level >= k
+        map[foreground] = labels[representative[self.pixel_node[foreground]]]
+        return map.reshape(self.shape)
+
+    def table(self, threshold):
+        """
+        Measurements of the components of image > threshold, from the moments kept in the tree.
+
+        :param threshold: Pixel intensity threshold
+        :return: feature table, with labels 1..n
+        :rtype: FeatureTable
+        """
+        return self._table(self._alive(self._level_index(threshold)))
+
+    def sweep(self, thresholds):
+        """
+        Measurements of the components for each of a sequence of thresholds.
+
+        :param thresholds: Pixel intensity thresholds
+        :return: list of feature tables
+        :rtype: list
+        """
+        return [self.table(threshold) for threshold in thresholds]
+
+    def persistence(self, thresholds):
+        """
+        How the components persist across a range of thresholds. The thresholds are sorted in
+        decreasing order, so that each component is contained in a component at the next threshold.
+
+        :param thresholds: Pixel intensity thresholds
+        :return: tuple of the sorted thresholds, their feature tables, and for each consecutive
+            pair of thresholds an array mapping the index of a component at the first threshold to
+            the index of the component containing it at the second
+        :rtype: tuple
+        """
+        thresholds = sorted(thresholds, reverse=True)
+        alive = [self._alive(self._level_index(threshold)) for threshold in thresholds]
+        containers = []
+        for k, current, following in zip([self._level_index(t) for t in thresholds[1:]], alive, alive[1:]):
+            representative, _ = self._representatives(k)
+            containers.append(np.searchsorted(following, representative[current]))
+        return thresholds, [self._table(nodes) for nodes in alive], containers
+
+    def _level_index(self, threshold):
+        if self.exact and not np.any(self.levels == threshold):
+            raise ValueError("Threshold {} is not one of the thresholds of the tree".format(threshold))
+        return np.searchsorted(self.levels, threshold, side='right')
+
+    def _alive(self, k):
+        # Nodes that are components of the pixels with level >= k.
+        parent_level = np.where(self.node_parent >= 0, self.node_level[np.maximum(self.node_parent, 0)], -1)
+        return np.flatnonzero((self.node_level >= k) & (parent_level < k))
+
+    def _representatives(self, k):
+        # Maps every node with level >= k to its ancestor that is a component at level k.
+        alive = self._alive(k)
+        representative = np.where(self.node_parent >= 0, self.node_parent, np.arange(len(self.node_parent)))
+        representative[alive] = alive
+        while True:
+            jumped = representative[representative]
+            if np.array_equal(jumped, representative):
+                return representative, alive
+            representative = jumped
+
+    def _table(self, nodes):
+        m00, m10, m01, m20, m11, m02 = self.node_moments[:, nodes]
+        xmean, ymean = m10 / m00, m01 / m00
+        return FeatureTable(np.arange(1, len(nodes) + 1), m00, xmean, ymean,
+                            m20 - xmean * m10, m02 - ymean * m01, m11 - xmean * m01)
+
+    def _build(self, pixel_level, width):
+        n = pixel_level.size
+        x, y = np.divmod(np.arange(n), width)
+        x, y = x.astype(np.float64), y.astype(np.float64)
+        pixel_moments = np.stack((np.ones(n), x, y, x * x, x * y, y * y))
+        # With thresholds, pixels above the highest threshold are at level len(self.levels)
+        levels = pixel_level.max() + 1
+        first, second = _edges(self.shape, self.connectivity)
+        edge_level = np.minimum(pixel_level[first], pixel_level[second])
+
+        pixel_order = np.argsort(pixel_level, kind='stable')
+        pixel_bounds = np.searchsorted(pixel_level[pixel_order], np.arange(levels + 1))
+        edge_order = np.argsort(edge_level, kind='stable')
+        edge_bounds = np.searchsorted(edge_level[edge_order], np.arange(levels + 1))
+
+        node_level = np.empty(n, dtype=np.int64)
+        node_parent = np.full(n, -1, dtype=np.int64)
+        node_moments = np.empty((6, n))
+        union = np.arange(n)
+        pixel_node = np.full(n, -1, dtype=np.int64)
+        position = np.empty(n, dtype=np.int64)
+        count = 0
+        for level in range(levels - 1, -1, -1):
+            pixels = pixel_order[pixel_bounds[level]:pixel_bounds[level + 1]]
+            if len(pixels) == 0:
+                continue
+            edges = edge_order[edge_bounds[level]:edge_bounds[level + 1]]
+            position[pixels] = np.arange(len(pixels))
+            # Every edge of this level has at least one end among the new pixels; the other end is
+            # a new pixel or belongs to a component formed at a higher level.
+            ends = []
+            for end in (first[edges], second[edges]):
+                new = pixel_level[end] == level
+                ends.append((end, new, _find(union, pixel_node[end[~new]])))
+            old = np.unique(np.concatenate([root for _, _, root in ends]))
+            vertices = []
+            for end, new, root in ends:
+                vertex = np.empty(len(end), dtype=np.int64)
+                vertex[new] = position[end[new]]
+                vertex[~new] = len(pixels) + np.searchsorted(old, root)
+                vertices.append(vertex)
+            component = graph_components(len(pixels) + len(old), vertices[0], vertices[1])
+            components = component.max() + 1
+            nodes = count + np.arange(components)
+            node_level[nodes] = level
+            moments = np.concatenate((pixel_moments[:, pixels], node_moments[:, old]), 1)
+            node_moments[:, nodes] = np.stack([np.bincount(component, m, components) for m in moments])
+            pixel_node[pixels] = nodes[component[:len(pixels)]]
+            node_parent[old] = nodes[component[len(pixels):]]
+            union[old] = node_parent[old]
+            count += components
+
+        self.pixel_level = pixel_level
+        self.pixel_node = pixel_node
+        self.node_level = node_level[:count]
+        self.node_parent = node_parent[:count]
+        self.node_moments = node_moments[:, :count]
+
+
+def _edges(shape, connectivity):
+    index = np.arange(shape[0] * shape[1]).reshape(shape)
+    pairs = [(index[:, :-1], index[:, 1:]), (index[:-1, :], index[1:, :])]
+    if connectivity == 2:
+        pairs += [(index[:-1, :-1], index[1:, 1:]), (index[:-1, 1:], index[1:, :-1])]
+    elif connectivity != 1:
+        raise ValueError("Unsupported connectivity {}".format(connectivity))
+    return np.concatenate([a.ravel() for a, _ in pairs]), np.concatenate([b.ravel() for _, b in pairs])
+
+
+def _find(union, nodes):
+    roots = nodes
+    while True:
+        parents = union[roots]
+        if np.array_equal(parents, roots):
+            break
+        roots = parents
+    union[nodes] = roots
+    return roots
+
@@ -1,21 +1,49 @@
+from math import comb
 import numpy as np
 import numpy.ma as ma
-from scipy import ndimage
+from pycomponents.component import eigen_2x2
+from explorer_util.instrumentation import timed, record
+
+
+# Number of field elements converted to float per block when accumulating moments.
+_BLOCK_ELEMENTS = 1 << 22
+
+# Relative tolerance for comparing moments and eigenvalues.
+_EPS = 1e-12
 
 
 class FeatureField(object):
     """
     A type representing a scalar field-like, 2-D, data structure.
 
+    The raw spatial moments are calculated once, up to the moment order of the field, and
+    cached on the field. Reassigning data invalidates the cache. The data is read in row
+    blocks, so a numpy.memmap can be used for fields larger than memory.
+
+    The origin is the global (row, column) coordinate of data[0, 0], so that a field cropped
+    from a larger image reports its moments and centroid in the coordinates of that image.
     """
-    def __init__(self, data):
+    def __init__(self, data, order=2, origin=(0, 0)):
+        self.order = order
+        self.origin = origin
         self.data = data
-        self._xmean = None
-        self._ymean = None
 
     def __repr__(self):
         return "FeatureField ({} {})".format(self.dim[0], self.dim[1])
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._raw_moments = None
+        self._center_moments = None
+        self._xmean = None
+        self._ymean = None
+        self._shape = None
+
     def is_binary(self):
         return self.data.dtype == np.bool
 
@@ -25,9 +53,49 @@ class FeatureField(object):
             dim = self.data.shape
             assert len(dim) == 2
             return dim
+        elif self._shape is not None:
+            return self._shape
         else:
             return 0, 0
 
+    def raw_moments(self, order=None):
+        """
+        The table of raw spatial moments M_ij for i, j <= order.
+
+        :param order: the highest moment order per axis. Defaults to the order of the field.
+        :type order: int
+        :return: array with M_ij at index [i, j]
+        :rtype: numpy.ndarray
+        """
+        order = self.order if order is None else order
+        if self._raw_moments is None or self._raw_moments.shape[0] <= order:
+            if self.data is None:
+                raise ValueError("Moment order {} exceeds the accumulated order {}".format(
+                    order, self._raw_moments.shape[0] - 1 if self._raw_moments is not None else None))
+            # Summed in the coordinates of the data, and shifted to the origin exactly
+            local = raw_moment_table(self.data, max(order, self.order))
+            self._raw_moments = center_moment_table(local, -self.origin[0], -self.origin[1])
+            self._center_moments = None
+        return self._raw_moments
+
+    def center_moments(self):
+        """
+        The table of spatial center moments mu_ij. If the field has data, the moments are summed
+        over coordinates relative to the centroid, since deriving them from the raw moments loses
+        precision for features far from the origin.
+
+        :return: array with mu_ij at index [i, j]
+        :rtype: numpy.ndarray
+        """
+        if self._center_moments is None:
+            raw = self.raw_moments()
+            xmean, ymean = self.centroid()
+            if self.data is not None:
+                self._center_moments = raw_moment_table(self.data, raw.shape[0] - 1, self.origin, (xmean, ymean))
+            else:
+                self._center_moments = center_moment_table(raw, xmean, ymean)
+        return self._center_moments
+
     def spatial_moment(self, moment):
         """
         Calculates the spatial moment M_ij
@@ -37,15 +105,8 @@ class FeatureField(object):
         :return: Spatial moment
         :rtype: float
         """
-        dimx, dimy = self.data.shape
-        x, y = np.mgrid[:dimx, :dimy]
         xmoment, ymoment = moment
-        if xmoment == 0 and ymoment >= 1:
-            return np.sum((y ** ymoment) * self.data)
-        elif ymoment == 0 and xmoment >= 1:
-            return np.sum((x ** xmoment) * self.data)
-        else:
-            return np.sum((x ** xmoment * y ** ymoment) * self.data)
+        return self.raw_moments(max(xmoment, ymoment))[xmoment, ymoment]
 
     def spatial_center_moment(self, moment):
         """
@@ -56,17 +117,16 @@ class FeatureField(object):
         :return: spatial center moment
         :rtype: float
         """
-        xmean = self._xmean if self._xmean is not None else self.xmean()
-        ymean = self._ymean if self._ymean is not None else self.ymean()
-        dimx, dimy = self.data.shape
-        x, y = np.mgrid[:dimx, :dimy]
         xmoment, ymoment = moment
-        return np.sum(((x-xmean) ** xmoment * (y-ymean) ** ymoment) * self.data)
+        self.raw_moments(max(xmoment, ymoment))
+        return self.center_moments()[xmoment, ymoment]
 
     @property
     def rad(self):
         """
-        The orientation angle in radians of the feature.
+        The orientation angle in radians of the feature, 0.5 * arctan(2 mu_11 / (mu_20 - mu_02)).
+        This is the angle of the major axis if mu_20 > mu_02 and of the minor axis otherwise, see
+        fit_ellipses.
 
         :return: angle (rad)
         :rtype: float
@@ -74,7 +134,7 @@ class FeatureField(object):
         mcen11 = self.spatial_center_moment((1, 1))
         mcen20 = self.spatial_center_moment((2, 0))
         mcen02 = self.spatial_center_moment((0, 2))
-        if mcen20 - mcen02 == 0:
+        if abs(mcen20 - mcen02) <= _EPS * (abs(mcen20) + abs(mcen02)):
             return 0.5 * np.arctan(np.inf)
         return 0.5 * np.arctan((2 * mcen11) / (mcen20 - mcen02))
 
@@ -125,12 +185,72 @@ class FeatureField(object):
         mean = m10/m00 if dim == 0 else m01 / m00
         return mean
 
+    @staticmethod
+    def from_tiles(tiles, order=2):
+        """
+        Creates a field by accumulating the raw moments tile by tile. Only one tile is held in
+        memory at a time, and the field does not keep the data.
+
+        :param tiles: iterable of (origin, tile) tuples, with origin the (row, column) of tile[0, 0]
+        :param order: the highest moment order per axis
+        :type order: int
+        :return: field with the merged moments
+        :rtype: FeatureField
+        """
+        field = FeatureField(None, order)
+        table = np.zeros((order + 1, order + 1))
+        centered = []
+        dimx, dimy = 0, 0
+        for origin, tile in tiles:
+            # Center moments per tile, about the tile centroid, merged below about the global centroid
+            raw = raw_moment_table(tile, order, origin)
+            if raw[0, 0] != 0:
+                mean = (raw[1, 0] / raw[0, 0], raw[0, 1] / raw[0, 0])
+                centered.append((mean, raw_moment_table(tile, order, origin, mean)))
+            table += raw
+            dimx = max(dimx, origin[0] + tile.shape[0])
+            dimy = max(dimy, origin[1] + tile.shape[1])
+        field._raw_moments = table
+        field._shape = (dimx, dimy)
+        if centered:
+            xmean, ymean = field.centroid()
+            field._center_moments = sum(center_moment_table(mu, xmean - mean[0], ymean - mean[1])
+                                        for mean, mu in centered)
+        return field
+
+    @staticmethod
+    def from_runs(feature, order=2):
+        """
+        Creates a field from a run-length encoded binary feature, with the moments calculated
+        from the runs. The field does not keep dense data.
+
+        :param feature: run-length encoded feature
+        :type feature: pyspatialfield.field.runlength.RunLengthFeature
+        :param order: the highest moment order per axis, at most 3
+        :type order: int
+        :return: field with the moments of the feature
+        :rtype: FeatureField
+        """
+        field = FeatureField(None, order)
+        if len(feature) == 0:
+            field._raw_moments = feature.raw_moments(order)
+            return field
+        # Moments about a corner of the feature, shifted exactly to the origin and the centroid
+        x0, y0 = int(feature.rows.min()), int(feature.starts.min())
+        local = type(feature)(feature.rows - x0, feature.starts - y0, feature.ends - y0).raw_moments(order)
+        field._raw_moments = center_moment_table(local, -x0, -y0)
+        field._shape = (int(feature.rows.max()) + 1, int(feature.ends.max()))
+        xmean, ymean = field.centroid()
+        field._center_moments = center_moment_table(local, xmean - x0, ymean - y0)
+        return field
+
     @staticmethod
     def create_field_with_features_from_image_files(file_background, file_foreground):
         raise NotImplementedError("create_field_with_features_from_image_files() not yet implemented")
 
     @staticmethod
-    def generate_from_single_image(decoder, threshold=50, preprocess=None, decoder_callback=None):
+    @timed("featurefield.generate_from_single_image")
+    def generate_from_single_image(decoder, threshold=50, preprocess=None, decoder_callback=None, labeler=None):
         """
         Generates a label map from a data source
 
@@ -138,8 +258,12 @@ class FeatureField(object):
         :param threshold: Pixel intensity threshold
         :param preprocess: Preprocessor function
         :param decoder_callback: Decoder callback
+        :param labeler: Labelling function returning a tuple of label map and number of features,
+            e.g. labeling.label_tiled for large images. Defaults to scipy.ndimage.label.
         :return: Tuple of decoded image and map with labelled features.
         """
+        if labeler is None:
+            from scipy.ndimage import label as labeler
         img_array = decoder.decode(callback=decoder_callback)
         if len(img_array.shape) == 3:
             img_array = np.mean(img_array, 2)
@@ -148,11 +272,11 @@ class FeatureField(object):
         else:
             array = img_array
         masked_array = np.ma.masked_where(array > threshold, array, copy=True)
-        labeled_map, n = ndimage.label(masked_array.mask)
+        labeled_map, n = labeler(masked_array.mask)
         return (img_array, labeled_map)
 
     @staticmethod
-    def get_feature_from_labelmap(map, label):
+    def get_feature_from_labelmap(map, label, crop=False):
         """
         Get a feature mask of a specific feature
 
@@ -160,9 +284,18 @@ class FeatureField(object):
         :type map: numpy.ndarray
         :param label: feature
         :type label: int
-        :return: feature map
+        :param crop: crop the mask to the bounding box of the feature
+        :type crop: bool
+        :return: feature map, or a tuple of the cropped feature map and its origin if crop is True
         :rtype: numpy.ndarray with dtype = bool
         """
+        if crop and label is not None and np.issubdtype(map.dtype, np.integer):
+            from scipy import ndimage
+            slices = ndimage.find_objects(map, max_label=label)
+            if len(slices) < label or slices[label - 1] is None:
+                return np.zeros((0, 0), dtype=bool), (0, 0)
+            rows, cols = slices[label - 1]
+            return map[rows, cols] == label, (rows.start, cols.start)
         if label is not None and map.dtype == np.int32:
             features = ma.masked_where(map == label, map).mask
         elif map.dtype == np.bool:
@@ -172,7 +305,25 @@ class FeatureField(object):
         return features
 
     @staticmethod
-    def generate_from_image_diff(array_foreground, array_background, threshold=10):
+    def iter_features_from_labelmap(map):
+        """
+        Get the feature masks of all features, each cropped to the bounding box of the feature.
+        The bounding boxes are found in a single pass over the map.
+
+        :param map: map with multiple features
+        :type map: numpy.ndarray
+        :return: iterator of (label, cropped feature map, origin) tuples
+        :rtype: iterator
+        """
+        from scipy import ndimage
+        for index, region in enumerate(ndimage.find_objects(map)):
+            if region is not None:
+                rows, cols = region
+                yield index + 1, map[rows, cols] == index + 1, (rows.start, cols.start)
+
+    @staticmethod
+    @timed("featurefield.generate_from_image_diff")
+    def generate_from_image_diff(array_foreground, array_background, threshold=10, labeler=None):
         """
         Generate a feature map based on pixel value difference between two sources, foreground and background.
 
@@ -181,9 +332,13 @@ class FeatureField(object):
         :param array_background: array for background source
         :type array_background: umpy.ndarray
         :param threshold: threshold value
+        :param labeler: labelling function returning a tuple of label map and number of features.
+            Defaults to scipy.ndimage.label.
         :return: feature map
         :rtype: numpy.ndarray
         """
+        if labeler is None:
+            from scipy.ndimage import label as labeler
         if len(array_foreground.shape) == 3:
             array_foreground = np.mean(array_foreground, 2)
         if len(array_background.shape) == 3:
@@ -191,7 +346,7 @@ class FeatureField(object):
         diffarray = abs(array_foreground[:, :] - array_background[:, :])
         masked_array = np.ma.masked_where(diffarray < threshold, diffarray, copy=True)
         binary_array = np.invert(masked_array.mask)
-        labeled_map, n = ndimage.label(binary_array)
+        labeled_map, n = labeler(binary_array)
         return labeled_map
 
     @staticmethod
@@ -200,6 +355,85 @@ class FeatureField(object):
         return iter(sorted(list(zip(unique[0], unique[1])), key=lambda x: x[1], reverse=True))
 
 
+def iter_tiles(data, tile_shape):
+    """
+    Splits a 2-D field into tiles. The tiles are views, so tiles of a numpy.memmap are read
+    from disk only when used.
+
+    :param data: 2-D field
+    :type data: numpy.ndarray
+    :param tile_shape: tile size (rows, columns)
+    :type tile_shape: tuple
+    :return: iterator of (origin, tile) tuples
+    :rtype: iterator
+    """
+    dimx, dimy = data.shape
+    rows, cols = tile_shape
+    for x0 in range(0, dimx, rows):
+        for y0 in range(0, dimy, cols):
+            yield (x0, y0), data[x0:x0 + rows, y0:y0 + cols]
+
+
+@timed("featurefield.raw_moment_table")
+def raw_moment_table(data, order=2, origin=(0, 0), reference=(0, 0)):
+    """
+    Calculates the raw spatial moments M_ij for all i, j <= order in a single pass, or the
+    moments about a reference point, i.e. the center moments if the reference is the centroid.
+
+    The field is reduced block-wise against the column powers, giving the row projections,
+    which are then reduced against the row powers. No full-size coordinate grids are allocated.
+
+    :param data: 2-D field
+    :type data: numpy.ndarray
+    :param order: the highest moment order per axis
+    :type order: int
+    :param origin: global coordinates (row, column) of data[0, 0]
+    :type origin: tuple
+    :param reference: global coordinates (row, column) the moments are taken about
+    :type reference: tuple
+    :return: array of shape (order + 1, order + 1) with M_ij at index [i, j]
+    :rtype: numpy.ndarray
+    """
+    dimx, dimy = data.shape
+    x0 = origin[0] - reference[0]
+    y0 = origin[1] - reference[1]
+    powers = np.arange(order + 1)
+    ypow = (np.arange(dimy, dtype=np.float64) + y0)[:, np.newaxis] ** powers
+    table = np.zeros((order + 1, order + 1))
+    step = max(1, _BLOCK_ELEMENTS // max(dimy, 1))
+    for start in range(0, dimx, step):
+        block = np.asarray(data[start:start + step], dtype=np.float64)
+        record("featurefield.raw_moment_table", "block_bytes", block.nbytes)
+        xpow = (np.arange(block.shape[0], dtype=np.float64) + (x0 + start))[:, np.newaxis] ** powers
+        table += xpow.T @ (block @ ypow)
+    return table
+
+
+def center_moment_table(raw, xmean, ymean):
+    """
+    Derives the spatial center moments mu_ij from the raw spatial moments M_ij by binomial
+    expansion of (x - xmean)^i (y - ymean)^j. More generally, shifts moments taken about one
+    point to moments about a point offset by (xmean, ymean) from it. The expansion cancels
+    large terms if the offset is large compared to the extent of the feature.
+
+    :param raw: raw moment table, with M_ij at index [i, j]
+    :type raw: numpy.ndarray
+    :param xmean: centroid along the first axis
+    :param ymean: centroid along the second axis
+    :return: center moment table, with mu_ij at index [i, j]
+    :rtype: numpy.ndarray
+    """
+    return _shift_matrix(raw.shape[0], xmean) @ raw @ _shift_matrix(raw.shape[1], ymean).T
+
+
+def _shift_matrix(size, mean):
+    shift = np.zeros((size, size))
+    for p in range(size):
+        for k in range(p + 1):
+            shift[p, k] = comb(p, k) * (-mean) ** (p - k)
+    return shift
+
+
 class EllipseFeature(object):
 
     def __init__(self, semi_major_axis=None, semi_minor_axis=None):
@@ -224,24 +458,45 @@ class EllipseFeature(object):
     def from_moments(self, mu20, mu02, mu11):
         """
         Calculates the ellipse parameters based on the mu_20, mu_02 and mu_11 spatial central moments.
+        The moments can be arrays, giving arrays of ellipse parameters. See fit_ellipses.
         :param mu20:
         :param mu02:
         :param mu11:
         :return:
         """
-        emax = self._eigv_max(mu20, mu02, mu11)
-        emin = self._eigv_min(mu20, mu02, mu11)
-        self.semi_major_axis = self._semiaxis_maj(emax, emin)
-        self.semi_minor_axis = self._semiaxis_min(emax, emin)
-
-    def _eigv_max(self, mu20, mu02, mu11):
-        return 0.5 * (mu20 + mu02 + np.sqrt((4 * (mu11 ** 2.)) + ((mu20 - mu02) ** 2.)))
+        _, _, _, semi_major_axis, semi_minor_axis = fit_ellipses(mu20, mu02, mu11)
+        self.semi_major_axis = semi_major_axis[()]
+        self.semi_minor_axis = semi_minor_axis[()]
 
-    def _eigv_min(self, mu20, mu02, mu11):
-        return 0.5 * (mu20 + mu02 - np.sqrt((4 * (mu11 ** 2.)) + ((mu20 - mu02) ** 2.)))
 
-    def _semiaxis_maj(self, emax, emin):
-        return ((4. / np.pi) ** (1. / 4.)) * (((emax ** 3) / emin) ** (1. / 8.))
-
-    def _semiaxis_min(self, emax, emin):
-        return ((4. / np.pi) ** (1. / 4.)) * (((emin ** 3) / emax) ** (1. / 8.))
+def fit_ellipses(mu20, mu02, mu11):
+    """
+    Fits ellipses to arrays of mu_20, mu_02 and mu_11 spatial central moments, with the closed-form
+    eigen decomposition of the 2x2 second moment matrices.
+
+    Degenerate features are handled explicitly: where the smallest eigenvalue is zero, e.g. for a
+    line, the semi-minor axis is 0 and the semi-major axis is undefined (nan). Where both
+    eigenvalues are zero, e.g. for a single pixel, both semi-axes are 0.
+
+    The orientation is the angle of the major axis from the x axis, in (-pi/2, pi/2]. This is not
+    the convention of FeatureField.rad and FeatureTable.rad, 0.5 * arctan(2 mu_11 / (mu_20 - mu_02))
+    in [-pi/4, pi/4], which is the angle of the major axis where mu_20 > mu_02 and of the minor axis
+    where mu_20 < mu_02. Where mu_20 = mu_02 it is pi/4. The two angles are equal modulo pi/2.
+
+    :param mu20: array of mu_20
+    :param mu02: array of mu_02
+    :param mu11: array of mu_11
+    :return: tuple of the major axis orientation in radians, eigenvalues (..., 2) in decreasing
+        order, eigenvectors (..., 2, 2) as columns, semi-major axes and semi-minor axes
+    :rtype: tuple
+    """
+    emax, emin, vmax = eigen_2x2(mu20, mu02, mu11)
+    rad = np.arctan2(vmax[..., 1], vmax[..., 0])
+    eigen_vectors = np.stack((vmax, np.stack((-vmax[..., 1], vmax[..., 0]), -1)), -1)
+    scale = (4. / np.pi) ** (1. / 4.)
+    flat = emin <= _EPS * emax
+    with np.errstate(divide='ignore', invalid='ignore'):
+        semi_major_axis = np.where(flat, np.nan, scale * ((emax ** 3) / emin) ** (1. / 8.))
+        semi_minor_axis = np.where(flat, 0., scale * ((emin ** 3) / emax) ** (1. / 8.))
+    semi_major_axis = np.where(emax <= 0, 0., semi_major_axis)
+    return rad, np.stack((emax, emin), -1), eigen_vectors, semi_major_axis, semi_minor_axis
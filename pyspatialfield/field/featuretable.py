@@ -0,0 +1,110 @@
+import numpy as np
+from pyspatialfield.field.featurefield import EllipseFeature, _EPS
+
+
+class FeatureTable(object):
+    """
+    Columnar measurements of all features in a label map.
+
+    Each attribute is an array with one entry per label, in the order of labels.
+    """
+    def __init__(self, labels, area, xmean, ymean, mu20, mu02, mu11):
+        self.labels = labels
+        self.area = area
+        self.xmean = xmean
+        self.ymean = ymean
+        self.mu20 = mu20
+        self.mu02 = mu02
+        self.mu11 = mu11
+
+    def __repr__(self):
+        return "FeatureTable ({} features)".format(len(self))
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def centroid(self):
+        """
+        The centroids of the features
+
+        :return: tuple of xmean and ymean arrays
+        :rtype: tuple
+        """
+        return self.xmean, self.ymean
+
+    @property
+    def rad(self):
+        """
+        The orientation angles in radians of the features, as FeatureField.rad.
+
+        :return: angles (rad)
+        :rtype: numpy.ndarray
+        """
+        diff = self.mu20 - self.mu02
+        equal = np.abs(diff) <= _EPS * (np.abs(self.mu20) + np.abs(self.mu02))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rad = 0.5 * np.arctan((2 * self.mu11) / diff)
+        return np.where(equal, 0.5 * np.arctan(np.inf), rad)
+
+    @property
+    def degrees(self):
+        """
+        The orientation angles in degrees of the features.
+
+        :return: angles (degrees)
+        :rtype: numpy.ndarray
+        """
+        return (self.rad / np.pi) * 180
+
+    def ellipse(self):
+        """
+        The ellipse parameters of the features
+
+        :return: ellipse with arrays of semi-major and semi-minor axes
+        :rtype: EllipseFeature
+        """
+        ellipse = EllipseFeature()
+        ellipse.from_moments(self.mu20, self.mu02, self.mu11)
+        return ellipse
+
+    def by_size(self):
+        """
+        Labels ordered by feature size, largest first.
+
+        :return: iterator of (label, area) tuples
+        :rtype: iterator
+        """
+        order = np.argsort(-self.area, kind='stable')
+        return zip(self.labels[order], self.area[order])
+
+    @staticmethod
+    def from_labelmap(map, include_background=False):
+        """
+        Measures all features of a label map with label-indexed reductions, visiting only the
+        labelled pixels.
+
+        :param map: map with multiple features
+        :type map: numpy.ndarray
+        :param include_background: include label 0 as a feature
+        :type include_background: bool
+        :return: feature table
+        :rtype: FeatureTable
+        """
+        flat = map.ravel()
+        index = np.arange(flat.size) if include_background else np.flatnonzero(flat)
+        labels = flat[index]
+        x, y = np.divmod(index, map.shape[1])
+        m00 = np.bincount(labels)
+        present = np.flatnonzero(m00)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xmean = np.bincount(labels, x) / m00
+            ymean = np.bincount(labels, y) / m00
+        dx = x - xmean[labels]
+        dy = y - ymean[labels]
+        nbins = m00.size
+        mu20 = np.bincount(labels, dx * dx, nbins)
+        mu02 = np.bincount(labels, dy * dy, nbins)
+        mu11 = np.bincount(labels, dx * dy, nbins)
+        return FeatureTable(present, m00[present].astype(np.float64), xmean[present], ymean[present],
+                            mu20[present], mu02[present], mu11[present])
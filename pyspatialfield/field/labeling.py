@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pyspatialfield.field.featurefield import iter_tiles
+
+
+def label_tiled(binary, tile_shape=(2048, 2048), workers=None, structure=None):
+    """
+    Labels the connected features of a binary image tile by tile on a thread pool, with the
+    same result as scipy.ndimage.label up to a permutation of the labels.
+
+    The tiles are labelled concurrently, as ndimage.label releases the GIL. Labels that meet
+    across the tile seams are merged as connected components of the graph of seam neighbours, and
+    each tile is then written to the output map with consecutive global labels from a lookup
+    table, also concurrently.
+
+    :param binary: binary image
+    :type binary: numpy.ndarray
+    :param tile_shape: tile size (rows, columns)
+    :type tile_shape: tuple
+    :param workers: number of threads. Defaults to the number of CPUs.
+    :type workers: int
+    :param structure: 3 x 3 connectivity structure as for ndimage.label. Defaults to edge-connected.
+    :type structure: numpy.ndarray
+    :return: tuple of the map with labelled features and the number of features
+    :rtype: tuple
+    """
+    from scipy import ndimage
+    structure = ndimage.generate_binary_structure(2, 1) if structure is None else np.asarray(structure, dtype=bool)
+    if structure.shape != (3, 3):
+        raise ValueError("Unsupported structure shape {}".format(structure.shape))
+    if binary.shape[0] <= tile_shape[0] and binary.shape[1] <= tile_shape[1]:
+        return ndimage.label(binary, structure)
+
+    workers = workers if workers is not None else os.cpu_count()
+    map = np.empty(binary.shape, dtype=np.int32)
+    tiles = [tile for _, tile in iter_tiles(binary, tile_shape)]
+    views = [view for _, view in iter_tiles(map, tile_shape)]
+
+    def label(k):
+        # Labelling into a contiguous array and copying it is about twice as fast as labelling
+        # into a view of the map.
+        local = np.empty(tiles[k].shape, dtype=np.int32)
+        count = ndimage.label(tiles[k], structure, output=local)
+        views[k][...] = local
+        return count
+
+    with ThreadPoolExecutor(workers) as executor:
+        counts = list(executor.map(label, range(len(tiles))))
+
+        # Tile k holds the global labels offsets[k] + 1 .. offsets[k] + counts[k]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        tile_columns = -(-binary.shape[1] // tile_shape[1])
+        grid = offsets[:-1].reshape(-1, tile_columns)
+        first, second = _seam_pairs(map, grid, tile_shape, structure)
+        component = graph_components(offsets[-1] + 1, first, second)
+        _, lut = np.unique(component, return_inverse=True)
+        n = lut.max()
+
+        def relabel(k):
+            tile_lut = lut[offsets[k]:offsets[k + 1] + 1].astype(np.int32)
+            tile_lut[0] = 0
+            views[k][...] = tile_lut[views[k]]
+        list(executor.map(relabel, range(len(views))))
+    return map, int(n)
+
+
+def _seam_pairs(map, grid, tile_shape, structure):
+    # Pairs of global labels of neighbouring pixels on either side of each seam.
+    rows, cols = tile_shape
+    row_tile = np.arange(map.shape[0]) // rows
+    col_tile = np.arange(map.shape[1]) // cols
+    first, second = [], []
+    for r in range(rows, map.shape[0], rows):
+        above = _to_global(map[r - 1], grid[row_tile[r - 1], col_tile])
+        below = _to_global(map[r], grid[row_tile[r], col_tile])
+        for dc in (-1, 0, 1):
+            if structure[2, 1 + dc]:
+                _append_pairs(first, second, above, below, dc)
+    for c in range(cols, map.shape[1], cols):
+        left = _to_global(map[:, c - 1], grid[row_tile, col_tile[c - 1]])
+        right = _to_global(map[:, c], grid[row_tile, col_tile[c]])
+        for dr in (-1, 0, 1):
+            if structure[1 + dr, 2]:
+                _append_pairs(first, second, left, right, dr)
+    if not first:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(first), np.concatenate(second)
+
+
+def _to_global(local, offset):
+    return np.where(local > 0, local + offset, 0)
+
+
+def _append_pairs(first, second, a, b, shift):
+    # Pairs a[i], b[i + shift] where both pixels are set.
+    if shift > 0:
+        a, b = a[:-shift], b[shift:]
+    elif shift < 0:
+        a, b = a[-shift:], b[:shift]
+    both = (a > 0) & (b > 0)
+    first.append(a[both])
+    second.append(b[both])
+
+
+def graph_components(n, first, second):
+    """
+    Connected components of an undirected graph, e.g. of labels that are equivalent across tile
+    seams.
+
+    :param n: number of nodes
+    :type n: int
+    :param first: first node of each edge
+    :type first: numpy.ndarray
+    :param second: second node of each edge
+    :type second: numpy.ndarray
+    :return: component index per node, numbered in order of the lowest node of each component
+    :rtype: numpy.ndarray
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    graph = coo_matrix((np.ones(len(first), dtype=np.int8), (first, second)), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+    return component
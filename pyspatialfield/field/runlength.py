@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class RunLengthFeature(object):
+    """
+    A binary feature stored as runs of set pixels along the rows. Run k covers the pixels
+    (rows[k], starts[k]) to (rows[k], ends[k] - 1), in image coordinates.
+
+    Memory and moment calculations scale with the number of runs, not the image size.
+    """
+
+    def __init__(self, rows, starts, ends):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    def __repr__(self):
+        return "RunLengthFeature ({} runs)".format(len(self.rows))
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def area(self):
+        return int(np.sum(self.ends - self.starts))
+
+    def raw_moments(self, order=2):
+        """
+        The raw spatial moments M_ij for i, j <= order, from closed-form power sums over each run.
+
+        :param order: the highest moment order per axis, at most 3
+        :type order: int
+        :return: array of shape (order + 1, order + 1) with M_ij at index [i, j]
+        :rtype: numpy.ndarray
+        """
+        if order > 3:
+            raise ValueError("Unsupported moment order {}".format(order))
+        x = self.rows.astype(np.float64)
+        xpow = x[np.newaxis, :] ** np.arange(order + 1)[:, np.newaxis]
+        ysums = np.array([_power_sum(j, self.ends) - _power_sum(j, self.starts) for j in range(order + 1)])
+        return xpow @ ysums.T
+
+    def to_mask(self, shape):
+        """
+        The feature as a dense mask.
+
+        :param shape: shape of the mask
+        :type shape: tuple
+        :return: mask
+        :rtype: numpy.ndarray with dtype = bool
+        """
+        mask = np.zeros(shape, dtype=bool)
+        mask.ravel()[_pixel_indices(self, shape[1])] = True
+        return mask
+
+    @staticmethod
+    def from_mask(mask, origin=(0, 0)):
+        """
+        Encode a mask, e.g. a cropped mask from FeatureField.get_feature_from_labelmap.
+
+        :param mask: binary mask
+        :type mask: numpy.ndarray
+        :param origin: image coordinates (row, column) of mask[0, 0]
+        :type origin: tuple
+        :return: feature
+        :rtype: RunLengthFeature
+        """
+        edges = np.diff(mask.astype(np.int8), axis=1, prepend=0, append=0)
+        rows, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+        return RunLengthFeature(rows + origin[0], starts + origin[1], ends + origin[1])
+
+    @staticmethod
+    def from_labelmap(map):
+        """
+        Encode all features of a label map in one pass.
+
+        :param map: map with multiple features
+        :type map: numpy.ndarray
+        :return: dictionary of label to feature
+        :rtype: dict
+        """
+        padded = np.pad(map, ((0, 0), (1, 1)))
+        changes = padded[:, 1:] != padded[:, :-1]
+        rows, starts = np.nonzero(changes[:, :-1] & (map != 0))
+        _, ends = np.nonzero(changes[:, 1:] & (map != 0))
+        ends += 1
+        labels = map[rows, starts]
+        order = np.argsort(labels, kind='stable')
+        labels, rows, starts, ends = labels[order], rows[order], starts[order], ends[order]
+        unique, first = np.unique(labels, return_index=True)
+        bounds = np.append(first, len(labels))
+        return {label: RunLengthFeature(rows[bounds[i]:bounds[i + 1]], starts[bounds[i]:bounds[i + 1]],
+                                        ends[bounds[i]:bounds[i + 1]])
+                for i, label in enumerate(unique)}
+
+    @staticmethod
+    def to_labelmap(features, shape, dtype=np.int32):
+        """
+        Decode features to a label map.
+
+        :param features: dictionary of label to feature
+        :type features: dict
+        :param shape: shape of the map
+        :type shape: tuple
+        :return: map with multiple features
+        :rtype: numpy.ndarray
+        """
+        map = np.zeros(shape, dtype=dtype)
+        flat = map.ravel()
+        for label, feature in features.items():
+            flat[_pixel_indices(feature, shape[1])] = label
+        return map
+
+
+def _power_sum(j, n):
+    # Sum of y^j over y = 0 .. n - 1.
+    n = n.astype(np.float64)
+    if j == 0:
+        return n
+    elif j == 1:
+        return n * (n - 1) / 2
+    elif j == 2:
+        return (n - 1) * n * (2 * n - 1) / 6
+    return (n * (n - 1) / 2) ** 2
+
+
+def _pixel_indices(feature, width):
+    lengths = feature.ends - feature.starts
+    offsets = np.cumsum(lengths) - lengths
+    first = feature.rows * width + feature.starts
+    return np.repeat(first - offsets, lengths) + np.arange(np.sum(lengths))
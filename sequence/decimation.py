@@ -0,0 +1,112 @@
+import numpy as np
+
+
+def decimate(x, y, n_out, method='minmax'):
+    """
+    Indices of a subset of a series that preserves its visual shape when drawn at a resolution
+    of about n_out pixels along x. The points are assumed sorted by x.
+
+    :param x: x values
+    :param y: y values
+    :param n_out: target number of points
+    :type n_out: int
+    :param method: 'minmax' keeps the first, last, minimum and maximum point of n_out / 4
+        equal-count buckets, 'lttb' is largest-triangle-three-buckets
+    :type method: str
+    :return: sorted indices
+    :rtype: numpy.ndarray
+    """
+    if len(y) <= n_out:
+        return np.arange(len(y))
+    if method == 'minmax':
+        return minmax_indices(y, max(1, n_out // 4))
+    elif method == 'lttb':
+        return lttb_indices(x, y, n_out)
+    else:
+        raise ValueError("Unsupported method " + method)
+
+
+def minmax_indices(y, buckets):
+    """
+    Indices of the first, last, minimum and maximum point of each of a number of equal-count
+    buckets. NaN values are ignored, and buckets of only NaN values keep only their first and last
+    point.
+
+    :param y: y values
+    :param buckets: number of buckets
+    :type buckets: int
+    :return: sorted indices
+    :rtype: numpy.ndarray
+    """
+    n = len(y)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    starts = edges[:-1][np.diff(edges) > 0]
+    counts = np.diff(np.append(starts, n))
+    extrema = [starts, starts + counts - 1]
+    for reduce in (np.fmin, np.fmax):
+        values = reduce.reduceat(y, starts)
+        candidates = np.flatnonzero(y == np.repeat(values, counts))
+        extrema.append(candidates[np.searchsorted(candidates, starts[~np.isnan(values)])])
+    return np.unique(np.concatenate(extrema))
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices selected by the largest-triangle-three-buckets algorithm. Each bucket is handled
+    with array operations, in one pass over the buckets.
+
+    :param x: x values
+    :param y: y values
+    :param n_out: number of points, at least 3
+    :type n_out: int
+    :return: sorted indices
+    :rtype: numpy.ndarray
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    # Averages of the buckets, the third point of each triangle.
+    sums = np.add.reduceat(np.column_stack((x, y))[1:n - 1], edges[:-1] - 1)
+    averages = sums / np.diff(edges)[:, np.newaxis]
+    averages = np.vstack((averages[1:], [[x[-1], y[-1]]]))
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        ax, ay = x[previous], y[previous]
+        cx, cy = averages[i]
+        areas = np.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        previous = start + np.argmax(areas)
+        selected[i + 1] = previous
+    return selected
+
+
+def decimate_points(x, y, width, height):
+    """
+    Indices of a subset of a point cloud with one point per occupied cell of a width x height
+    grid over the extent of the points.
+
+    :param x: x values
+    :param y: y values
+    :param width: number of cells along x
+    :param height: number of cells along y
+    :return: sorted indices
+    :rtype: numpy.ndarray
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= width * height:
+        return np.arange(len(x))
+    column = _cell(x, width)
+    row = _cell(y, height)
+    _, first = np.unique(row * width + column, return_index=True)
+    return np.sort(first)
+
+
+def _cell(values, cells):
+    low, high = np.min(values), np.max(values)
+    if high == low:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / (high - low) * cells).astype(np.int64), cells - 1)
@@ -1,12 +1,63 @@
-import time
+import datetime
 import numpy as np
 from numpy import linalg
+from sequence.decimation import decimate
+
+
+_EPOCH = np.datetime64(0, 'us')
+
+# Number of windows per block in rolling regressions. The sums of each block are taken about the
+# means of its points, so that the cancellation does not grow with the length of the series.
+_ROLLING_BLOCK = 1024
 
 
 class Series(object):
+    """
+    A discrete series of values over time.
 
-    def __init__(self, data: np.ndarray):
-        self.data = data
+    Time and values are kept as separate columns. Times given as datetime objects, ISO 8601
+    strings or datetime64 values are stored as a datetime64[us] column in UTC, see
+    to_datetime64. Numeric times are stored as they are, unless a unit is given, in which case
+    they are taken to be epoch values in that unit.
+
+    The points are kept sorted by time, so segments are found by binary search and returned as
+    views of the series.
+    """
+
+    def __init__(self, data: np.ndarray = None, time=None, values=None, tz=None, unit=None):
+        self.tz = tz
+        self.unit = unit
+        if data is not None:
+            self.data = data
+        else:
+            self._set_columns(time, values)
+
+    def __repr__(self):
+        return "Series ({} points)".format(len(self))
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def data(self):
+        """
+        The series as one array of [time, value] rows. Datetime64 times are returned as datetime
+        objects in an object array.
+        """
+        if np.issubdtype(self.time.dtype, np.datetime64):
+            data = np.empty((len(self.time), 2), dtype=object)
+            data[:, 0] = self.time.astype(object)
+            data[:, 1] = self.values
+            return data
+        return np.column_stack((self.time, self.values))
+
+    @data.setter
+    def data(self, data):
+        data = np.asarray(data)
+        shp = data.shape
+        if shp[1] != 2:
+            data = data.reshape(int(shp[0] / 2), 2)
+        self._set_columns(data[:, 0], data[:, 1])
 
     def filter_by_segment(self, lower,
                           upper):
@@ -14,25 +65,269 @@ class Series(object):
         """
         Filter by lower and upper bound of indices
         """
-        shp = self.data.shape
-        data = self.data
-        if shp[1] != 2:
-            data = self.data.reshape(int(shp[0] / 2), 2)
-        mask = (data[:, 0] > lower) \
-               & (data[:, 0] < upper)
-        self.data = data[mask]
+        start, end = self.segment_indices(lower, upper)
+        self.time = self.time[start:end]
+        self.values = self.values[start:end]
+
+    def segment(self, lower, upper):
+        """
+        The points with lower < time < upper, as a view of the series.
+
+        :param lower: lower bound, exclusive
+        :param upper: upper bound, exclusive
+        :return: segment
+        :rtype: Series
+        """
+        start, end = self.segment_indices(lower, upper)
+        return self._view(start, end)
+
+    def segments(self, lowers, uppers):
+        """
+        The segments for arrays of lower and upper bounds, as views of the series.
+
+        :param lowers: lower bounds, exclusive
+        :param uppers: upper bounds, exclusive
+        :return: list of segments
+        :rtype: list of Series
+        """
+        starts, ends = self.segment_indices(lowers, uppers)
+        return [self._view(start, end) for start, end in zip(starts, ends)]
+
+    def segment_indices(self, lowers, uppers):
+        """
+        Index ranges of the points with lower < time < upper, by binary search in the time
+        column. Accepts scalar bounds or arrays of bounds.
+
+        :return: tuple of start and end indices
+        :rtype: tuple
+        """
+        lowers, uppers = self._time_bounds(lowers, uppers)
+        starts = np.searchsorted(self.time, lowers, side='right')
+        ends = np.maximum(np.searchsorted(self.time, uppers, side='left'), starts)
+        return starts, ends
 
     def to_epoch_seconds(self):
-        f = np.vectorize(lambda x: time.mktime(x.timetuple()))
-        # self.data = np.array([f(self.data.T[0]), self.data.T[1]]).T
-        self.data = np.array([f(self.data.T[0]), self.data.T[1]]).T
+        """
+        Convert a datetime64 time column to epoch seconds.
+        """
+        if np.issubdtype(self.time.dtype, np.datetime64):
+            self.time = self.epoch_seconds()
+
+    def epoch_seconds(self):
+        """
+        The time column in epoch seconds, or as float if the times are numeric.
+
+        :return: time
+        :rtype: numpy.ndarray
+        """
+        if np.issubdtype(self.time.dtype, np.datetime64):
+            return (self.time - _EPOCH).astype(np.int64) / 1e6
+        return self.time.astype(float)
 
     def linear_coefficients(self, method='lstsq'):
         if method == 'lstsq':
-            x = self.data.T[0]
-            y = self.data.T[1]
+            x = self.epoch_seconds()
+            y = self.values
             A = np.vstack([x, np.ones(len(x))]).T
             m, c = np.linalg.lstsq(A.astype(float), y.astype(float), rcond=None)[0]
             return m, c
         else:
             raise ValueError("Unsupported method " + method)
+
+    def online_regression(self):
+        """
+        A running linear regression of the series, to which new points can be added in O(1).
+
+        :return: regression
+        :rtype: OnlineLinearRegression
+        """
+        regression = OnlineLinearRegression()
+        regression.extend(self.epoch_seconds(), self.values)
+        return regression
+
+    def rolling_linear_coefficients(self, window):
+        """
+        Least squares slope and intercept of every window of consecutive points, from cumulative
+        sums. The windows are handled in blocks, with times and values centered on the block
+        before summing to limit cancellation.
+
+        :param window: number of points per window, at least 2
+        :type window: int
+        :return: tuple of slope and intercept arrays, with len(series) - window + 1 entries
+        :rtype: tuple
+        """
+        if window < 2:
+            raise ValueError("Window must be at least 2 points, got {}".format(window))
+        x = self.epoch_seconds()
+        y = self.values.astype(float)
+        count = max(len(x) - window + 1, 0)
+        m = np.empty(count)
+        c = np.empty(count)
+        for start in range(0, count, _ROLLING_BLOCK):
+            stop = min(start + _ROLLING_BLOCK, count)
+            xb = x[start:stop + window - 1]
+            yb = y[start:stop + window - 1]
+            xshift, yshift = xb.mean(), yb.mean()
+            xb, yb = xb - xshift, yb - yshift
+            sums = [np.concatenate(([0.], np.cumsum(a))) for a in (xb, yb, xb * xb, xb * yb)]
+            sx, sy, sxx, sxy = [s[window:] - s[:-window] for s in sums]
+            slope = (sxy - sx * sy / window) / (sxx - sx * sx / window)
+            m[start:stop] = slope
+            c[start:stop] = (sy - slope * sx) / window + yshift - slope * xshift
+        return m, c
+
+    def decimate(self, width, method='minmax'):
+        """
+        A subset of the series that preserves its shape when drawn width pixels wide.
+
+        :param width: target width in pixels
+        :type width: int
+        :param method: 'minmax' or 'lttb', see sequence.decimation.decimate
+        :return: decimated series
+        :rtype: Series
+        """
+        indices = decimate(self.epoch_seconds(), self.values, width, method)
+        view = self._view(0, len(self))
+        view.time, view.values = self.time[indices], self.values[indices]
+        return view
+
+    def _set_columns(self, time, values):
+        time = np.asarray(time)
+        if _is_datetime_like(time):
+            time = to_datetime64(time, self.tz)
+        elif self.unit is not None:
+            time = to_datetime64(time, unit=self.unit)
+        elif time.dtype == object:
+            time = time.astype(float)
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = values.astype(float)
+        if len(time) > 1 and np.any(time[1:] < time[:-1]):
+            order = np.argsort(time, kind='stable')
+            time, values = time[order], values[order]
+        self.time = time
+        self.values = values
+
+    def _view(self, start, end):
+        view = Series.__new__(Series)
+        view.tz = self.tz
+        view.unit = self.unit
+        view.time = self.time[start:end]
+        view.values = self.values[start:end]
+        return view
+
+    def _time_bounds(self, lower, upper):
+        if np.issubdtype(self.time.dtype, np.datetime64):
+            lower, upper = np.asarray(lower), np.asarray(upper)
+            if lower.ndim == 0:
+                # Each bound is converted on its own, so that strings, datetime objects and
+                # datetime64 values each take their own path in to_datetime64
+                return to_datetime64(lower[np.newaxis], self.tz)[0], to_datetime64(upper[np.newaxis], self.tz)[0]
+            return to_datetime64(lower, self.tz), to_datetime64(upper, self.tz)
+        return lower, upper
+
+
+class OnlineLinearRegression(object):
+    """
+    Least squares fit of y = m x + c, kept as running counts, means and co-moments, so that
+    adding a point updates the coefficients in O(1).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.xmean = 0.
+        self.ymean = 0.
+        self.sxx = 0.
+        self.sxy = 0.
+
+    def __repr__(self):
+        return "OnlineLinearRegression ({} points)".format(self.n)
+
+    def update(self, x, y):
+        """
+        Add one point.
+        """
+        self.n += 1
+        dx = x - self.xmean
+        self.xmean += dx / self.n
+        self.ymean += (y - self.ymean) / self.n
+        self.sxx += dx * (x - self.xmean)
+        self.sxy += dx * (y - self.ymean)
+
+    def extend(self, x, y):
+        """
+        Add arrays of points, merged with the running statistics by the pairwise update.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        n = len(x)
+        if n == 0:
+            return
+        xmean, ymean = x.mean(), y.mean()
+        sxx = np.sum((x - xmean) ** 2)
+        sxy = np.sum((x - xmean) * (y - ymean))
+        total = self.n + n
+        dx, dy = xmean - self.xmean, ymean - self.ymean
+        self.sxx += sxx + dx * dx * self.n * n / total
+        self.sxy += sxy + dx * dy * self.n * n / total
+        self.xmean += dx * n / total
+        self.ymean += dy * n / total
+        self.n = total
+
+    def coefficients(self):
+        """
+        The slope and intercept of the fit. Both are NaN while the fit is undefined, i.e. for
+        fewer than two points or points with a single x value.
+
+        :return: tuple of slope and intercept
+        :rtype: tuple
+        """
+        if self.n < 2 or self.sxx == 0:
+            return np.nan, np.nan
+        m = self.sxy / self.sxx
+        return m, self.ymean - m * self.xmean
+
+
+def to_datetime64(time, tz=None, unit=None):
+    """
+    Converts times to a datetime64[us] array in UTC.
+
+    Accepts datetime64 values, datetime objects, ISO 8601 strings without offset or with a 'Z'
+    suffix, and numeric epoch values in the given unit. Naive datetimes and strings are taken to
+    be in tz, a fixed offset timezone, or in UTC if tz is None. Timezone-aware datetime objects
+    are converted with their own offset.
+
+    :param time: times
+    :param tz: timezone of naive times
+    :type tz: datetime.tzinfo
+    :param unit: unit of numeric epoch values, e.g. 's' or 'ms'
+    :type unit: str
+    :return: times
+    :rtype: numpy.ndarray with dtype = datetime64[us]
+    """
+    time = np.asarray(time)
+    if np.issubdtype(time.dtype, np.number):
+        if unit is None:
+            raise ValueError("A unit is required to convert numeric times")
+        scale = np.timedelta64(1, unit) / np.timedelta64(1, 'us')
+        return _EPOCH + np.round(time * scale).astype(np.int64).astype('timedelta64[us]')
+    if time.dtype.kind in ('U', 'S'):
+        time = np.char.rstrip(time, 'Z')
+    elif time.dtype == object and len(time) > 0 and getattr(time.flat[0], 'tzinfo', None) is not None:
+        offsets = np.array([t.utcoffset() for t in time.flat], dtype='timedelta64[us]').reshape(time.shape)
+        naive = np.array([t.replace(tzinfo=None) for t in time.flat], dtype='datetime64[us]').reshape(time.shape)
+        return naive - offsets
+    converted = time.astype('datetime64[us]', copy=False)
+    if tz is not None:
+        offset = tz.utcoffset(None)
+        if offset is None:
+            raise ValueError("tz must be a fixed offset timezone, e.g. datetime.timezone")
+        converted = converted - np.timedelta64(offset)
+    return converted
+
+
+def _is_datetime_like(time):
+    if np.issubdtype(time.dtype, np.datetime64) or time.dtype.kind in ('U', 'S'):
+        return True
+    return time.dtype == object and len(time) > 0 \
+        and isinstance(time.flat[0], (datetime.date, str, np.datetime64))
@@ -3,7 +3,7 @@ import pyspatialfield
 setup(
     name="pyspatialfield",
     version=pyspatialfield.__version__,
-    packages=find_packages(exclude=("test",)),
+    packages=find_packages(exclude=("test", "benchmark")),
     install_requires=[
         'numpy>=1.16.1',
         'scipy>=1.2.1',
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from pyspatialfield.field.batch import run_batch, measure_file
+
+
+class TestBatch(unittest.TestCase):
+
+    directory = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for i in range(4):
+            image = np.zeros((20, 20), dtype=np.uint8)
+            image[2:4 + i, 2:6] = 255
+            image[10:12, 10:12] = 255
+            Image.fromarray(image).save(os.path.join(cls.directory.name, "image{}.png".format(i)))
+        with open(os.path.join(cls.directory.name, "broken.png"), "wb") as f:
+            f.write(b"not an image")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def _files(self):
+        return [os.path.join(TestBatch.directory.name, name)
+                for name in ("image0.png", "broken.png", "image1.png", "image2.png", "image3.png")]
+
+    def test_run_batch_ordered(self):
+        results = list(run_batch(self._files(), processes=2, max_in_flight=2))
+        self.assertEqual([r.file for r in results], self._files())
+        self.assertEqual([r.ok for r in results], [True, False, True, True, True])
+        self.assertTrue(results[1].error.startswith("OSError"))
+        for i, result in enumerate(r for r in results if r.ok):
+            self.assertEqual(len(result.table), 2)
+            self.assertEqual(sorted(result.table.area), [4, 8 + 4 * i])
+
+    def test_run_batch_unordered(self):
+        results = list(run_batch(self._files(), processes=2, ordered=False))
+        self.assertEqual(sorted(r.file for r in results), sorted(self._files()))
+        table = measure_file(self._files()[0])
+        ok = [r for r in results if r.file == self._files()[0]][0]
+        np.testing.assert_array_equal(ok.table.area, table.area)
+
+
+if __name__ == '__main__':
+    unittest.main()
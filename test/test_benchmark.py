@@ -0,0 +1,25 @@
+import unittest
+from benchmark import suite
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_and_compare(self):
+        report = suite.run(["featurefield_moments", "series_segments"], sizes=1, repeat=1, log=lambda line: None)
+        self.assertEqual([r["name"] for r in report["results"]], ["featurefield_moments", "series_segments"])
+        self.assertTrue(all(r["seconds"] > 0 and r["peak_bytes"] > 0 for r in report["results"]))
+        self.assertEqual(suite.compare(report, report), [])
+
+    def test_compare_flags_regressions(self):
+        baseline = {"results": [{"name": "decode", "size": 256, "seconds": 1.0, "peak_bytes": 100},
+                                {"name": "decode", "size": 512, "seconds": 1.0, "peak_bytes": 100}]}
+        current = {"results": [{"name": "decode", "size": 256, "seconds": 1.1, "peak_bytes": 300},
+                               {"name": "decode", "size": 512, "seconds": 2.0, "peak_bytes": 100},
+                               {"name": "decode", "size": 1024, "seconds": 9.0, "peak_bytes": 100}]}
+        regressions = suite.compare(baseline, current, tolerance=0.2)
+        self.assertEqual([(name, size, metric) for name, size, metric, _, _ in regressions],
+                         [("decode", 256, "peak_bytes"), ("decode", 512, "seconds")])
+
+
+if __name__ == '__main__':
+    unittest.main()
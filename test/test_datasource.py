@@ -0,0 +1,215 @@
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+import os
+from pathlib import Path
+import tempfile
+import threading
+import unittest
+import numpy as np
+from PIL import Image
+from explorer_util.datasource import DataSource, DataDecoder, CallbackRunner, CsvReader, decode_image_to_array, \
+    load_excel_doc_from_buf, read_xlsx_columns, get_columns_from_xlsx_workbook
+from openpyxl import Workbook
+from explorer_util.cache import DecodedImageCache, CachedDecoder
+from pyspatialfield.field.featurefield import FeatureField
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+
+    body = None
+
+    def do_GET(self):
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(_ImageHandler.body)))
+        self.end_headers()
+        self.wfile.write(_ImageHandler.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDataSource(unittest.TestCase):
+
+    server, image = None, None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.image = np.arange(48, dtype=np.uint8).reshape(6, 8)
+        buf = BytesIO()
+        Image.fromarray(cls.image).save(buf, format="PNG")
+        _ImageHandler.body = buf.getvalue()
+        cls.server = HTTPServer(("127.0.0.1", 0), _ImageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _url(self, path):
+        return "http://127.0.0.1:{}/{}".format(TestDataSource.server.server_port, path)
+
+    def test_fetch_many_decodes_in_order(self):
+        urls = [self._url("snapshot{}.png".format(i)) for i in range(10)]
+        results = list(DataSource.fetch_many(urls, callback=decode_image_to_array, concurrency=4))
+        self.assertEqual([url for url, _ in results], urls)
+        for _, array in results:
+            np.testing.assert_array_equal(array, TestDataSource.image)
+
+    def test_fetch_many_captures_errors(self):
+        urls = [self._url("snapshot.png"), self._url("missing.png")]
+        (_, content), (_, error) = DataSource.fetch_many(urls, retries=0, return_exceptions=True)
+        self.assertEqual(content, _ImageHandler.body)
+        self.assertIsInstance(error, Exception)
+
+    def test_fetch_many_raises_promptly(self):
+        fetched = []
+
+        def urls():
+            for i in range(1000):
+                fetched.append(i)
+                yield self._url("missing.png" if i == 0 else "snapshot.png")
+        with self.assertRaises(Exception):
+            list(DataSource.fetch_many(urls(), concurrency=2, retries=0))
+        self.assertLessEqual(len(fetched), 5)
+
+    def test_decode_options(self):
+        rgb = np.random.default_rng(0).integers(0, 255, (64, 47, 3)).astype(np.uint8)
+        for fmt in ("PNG", "JPEG"):
+            buf = BytesIO()
+            Image.fromarray(rgb).save(buf, format=fmt)
+            decoder = DataDecoder(buf.getvalue(), mode="L", dtype=np.uint8)
+            self.assertEqual(decoder.inspect(), (fmt, (47, 64), "RGB"))
+            gray = decoder.decode()
+            self.assertEqual((gray.shape, gray.dtype), ((64, 47), np.uint8))
+            reduced = DataDecoder(buf.getvalue(), reduce=3).decode()
+            self.assertEqual((reduced.shape, reduced.dtype), ((22, 16, 3), np.float32))
+        # Modes that Image.reduce does not support
+        deep = (np.arange(64 * 47, dtype=np.uint16) * 20).reshape(64, 47)
+        buf = BytesIO()
+        Image.fromarray(deep).save(buf, format="PNG")
+        reduced = DataDecoder(buf.getvalue(), dtype=np.uint16, reduce=2).decode()
+        self.assertEqual((reduced.shape, reduced.dtype), ((32, 24), np.uint16))
+        self.assertEqual(reduced[0, 0], np.mean(deep[:2, :2]))
+        buf = BytesIO()
+        Image.fromarray(rgb).convert("P").save(buf, format="PNG")
+        self.assertEqual(DataDecoder(buf.getvalue(), reduce=2).decode().shape, (32, 24))
+        reduced = DataDecoder(buf.getvalue(), mode="L", dtype=np.uint8, reduce=2).decode()
+        self.assertEqual((reduced.shape, reduced.dtype), ((32, 24), np.uint8))
+        buf = BytesIO()
+        Image.fromarray(rgb[..., 0] > 127).save(buf, format="PNG")
+        self.assertEqual(DataDecoder(buf.getvalue(), reduce=3).decode().shape, (22, 16))
+
+    def test_decoded_image_cache(self):
+        body = _ImageHandler.body
+        cache = DecodedImageCache(max_bytes=2 * TestDataSource.image.size * 4)
+        first = cache.decode(body)
+        self.assertIs(cache.decode(body), first)
+        self.assertFalse(first.flags.writeable)
+        cache.decode(body, mode="L")
+        cache.decode(body, dtype=np.uint8)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 3, 1))
+        _, labeled_map = FeatureField.generate_from_single_image(CachedDecoder(body, cache), threshold=40)
+        self.assertEqual(labeled_map.max(), 1)
+
+    def test_decoded_image_cache_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            DecodedImageCache(directory=directory).decode(_ImageHandler.body)
+            cache = DecodedImageCache(directory=directory)
+            array = cache.decode(_ImageHandler.body)
+            self.assertIsInstance(array, np.memmap)
+            np.testing.assert_array_equal(array, TestDataSource.image)
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            del array
+
+    def test_decoded_image_cache_shared_by_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DecodedImageCache(directory=directory)
+            modes = [None, "L", "RGB"] * 20
+            with ThreadPoolExecutor(6) as executor:
+                arrays = list(executor.map(lambda mode: cache.decode(_ImageHandler.body, mode=mode), modes))
+            stats = cache.stats()
+            self.assertEqual(stats["hits"] + stats["disk_hits"] + stats["misses"], len(modes))
+            self.assertEqual(stats["entries"], 3)
+            self.assertEqual(stats["bytes"], sum(a.nbytes for a in arrays[:3]))
+            self.assertEqual(sorted(f.endswith(".npy") for f in os.listdir(directory)), [True] * 3)
+            del arrays
+
+    def test_callback_runner_stream(self):
+        urls = [self._url("snapshot{}.png".format(i)) for i in range(6)]
+        runner = CallbackRunner().add(DataSource.fetch_from_online_source, workers=3) \
+            .add(decode_image_to_array).add(np.sum)
+        results = list(runner.stream(urls, queue_size=2))
+        self.assertEqual(results, [TestDataSource.image.sum()] * 6)
+        fetch, decode, total = runner.stats
+        self.assertEqual((fetch.name, fetch.items, fetch.nbytes), ("fetch_from_online_source", 6, 6 * len(_ImageHandler.body)))
+        self.assertEqual((decode.items, decode.nbytes), (6, 6 * TestDataSource.image.size * 4))
+        self.assertEqual(len(runner.report()), 3)
+        self.assertGreater(fetch.seconds, 0)
+
+    def test_csv_reader_chunks_and_npy(self):
+        filename = Path(os.path.dirname(os.path.abspath(__file__))) / "dataset1.csv"
+        expected = np.genfromtxt(filename, delimiter=',')
+        reader = CsvReader(filename, usecols=(1,), chunk_rows=10)
+        self.assertEqual([chunk.shape for chunk in reader], [(10, 1), (10, 1), (5, 1)])
+        self.assertEqual(reader.rows, 25)
+        np.testing.assert_array_equal(DataSource().load(filename), expected)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dataset1.npy")
+            self.assertEqual(CsvReader(filename, chunk_rows=7).to_npy(path), (25, 2))
+            mapped = DataSource().load(path)
+            self.assertIsInstance(mapped, np.memmap)
+            np.testing.assert_array_equal(mapped, expected)
+            del mapped
+
+    def test_load_csv_with_header_and_empty_fields(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "missing.csv")
+            with open(filename, "w") as f:
+                f.write("a,b\n1,2\n3,\n")
+            expected = np.genfromtxt(filename, delimiter=',')
+            np.testing.assert_array_equal(DataSource().load(filename), expected)
+            np.testing.assert_array_equal(DataSource().load(filename, skiprows=1), [[1, 2], [3, np.nan]])
+            self.assertRaises(ValueError, CsvReader(filename, dtype=np.int64).read)
+            filename = os.path.join(directory, "column.csv")
+            with open(filename, "w") as f:
+                f.write("1\n2\n3\n")
+            self.assertEqual(DataSource().load(filename).shape, (3,))
+            path = os.path.join(directory, "column.npy")
+            self.assertEqual(CsvReader(filename).to_npy(path), (3,))
+            mapped = DataSource().load(path)
+            np.testing.assert_array_equal(mapped, DataSource().load(filename))
+            del mapped
+
+    def test_read_xlsx_columns_streaming(self):
+        wb = Workbook()
+        sheet = wb.create_sheet("values")
+        sheet.append(["index", "skipped", "value"])
+        for i in range(200):
+            sheet.append([i, "-", 0.5 * i])
+        buf = BytesIO()
+        wb.save(buf)
+        wb = load_excel_doc_from_buf(buf.getvalue(), read_only=True)
+        index, value = read_xlsx_columns(wb, columns=(1, 3), dtypes=(np.int64, np.float64), sheet="values",
+                                         block_rows=64)
+        np.testing.assert_array_equal(index, np.arange(200))
+        np.testing.assert_array_equal(value, 0.5 * np.arange(200))
+        rows = get_columns_from_xlsx_workbook(wb, columns=(1, 3), min_row=12, max_row=21, sheet="values")
+        self.assertEqual(rows.shape, (10, 2))
+        self.assertEqual(tuple(rows[0]), (10, 5.0))
+        # max_row beyond the sheet, or before min_row
+        index, = read_xlsx_columns(wb, columns=(1,), dtypes=(np.int64,), min_row=190, max_row=10 ** 9,
+                                   sheet="values")
+        np.testing.assert_array_equal(index, np.arange(188, 200))
+        index, = read_xlsx_columns(wb, columns=(1,), dtypes=(np.int64,), min_row=20, max_row=10, sheet="values")
+        self.assertEqual(len(index), 0)
+        wb.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+# Import time budgets in seconds per module, measured after numpy is imported.
+BUDGETS = {
+    "explorer_util.datasource": 0.05,
+    "explorer_util.cache": 0.05,
+    "explorer_util.visualization": 0.05,
+    "explorer_util.instrumentation": 0.05,
+    "pyspatialfield.field.featurefield": 0.05,
+    "pyspatialfield.field.featuretable": 0.05,
+    "pyspatialfield.field.runlength": 0.05,
+    "pyspatialfield.field.labeling": 0.05,
+    "sequence.discrete": 0.05,
+    "pycomponents.component": 0.05,
+}
+
+# Optional dependencies that are only imported by the code paths that need them.
+LAZY = ("requests", "PIL", "openpyxl", "matplotlib", "scipy")
+
+_SCRIPT = """
+import json, sys, time
+import numpy
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+class TestImports(unittest.TestCase):
+
+    def _measure(self, module):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, "-c", _SCRIPT.format(module=module, lazy=LAZY)], cwd=root,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output)
+
+    def test_import_time_budgets(self):
+        for module, budget in BUDGETS.items():
+            with self.subTest(module=module):
+                # Best of three, to be robust against a busy machine.
+                results = [self._measure(module) for _ in range(3)]
+                self.assertEqual(results[0]["loaded"], [])
+                self.assertLess(min(r["seconds"] for r in results), budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
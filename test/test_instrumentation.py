@@ -0,0 +1,59 @@
+from io import BytesIO, StringIO
+import json
+import unittest
+import numpy as np
+from PIL import Image
+from explorer_util import instrumentation
+from explorer_util.datasource import DataDecoder
+from pyspatialfield.field.featurefield import FeatureField
+from pycomponents.component import ComponentEvaluator
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    buf = None
+
+    @classmethod
+    def setUpClass(cls):
+        image = np.zeros((32, 32), dtype=np.uint8)
+        image[4:8, 4:12] = 255
+        buf = BytesIO()
+        Image.fromarray(image).save(buf, format="PNG")
+        cls.buf = buf.getvalue()
+
+    def test_profile_records_hot_paths(self):
+        with instrumentation.profile() as sink:
+            for _ in range(5):
+                _, labeled_map = FeatureField.generate_from_single_image(DataDecoder(TestInstrumentation.buf))
+            FeatureField(labeled_map > 0).rad
+            list(ComponentEvaluator(np.random.default_rng(0).normal(size=(50, 3))))
+        self.assertFalse(instrumentation.enabled)
+        summary = sink.summary()
+        self.assertEqual(summary[("datasource.decode", "seconds")]["count"], 5)
+        self.assertEqual(summary[("datasource.decode", "bytes")]["total"], 5 * 32 * 32 * 4)
+        self.assertEqual(summary[("featurefield.generate_from_single_image", "seconds")]["count"], 5)
+        self.assertIn(("featurefield.raw_moment_table", "block_bytes"), summary)
+        self.assertIn(("component.calculate_eigenvector", "seconds"), summary)
+        self.assertEqual(sorted(sink.percentiles("datasource.decode")), [50, 90, 99])
+
+    def test_disabled_records_nothing(self):
+        sink = instrumentation.MemorySink()
+        instrumentation.add_sink(sink)
+        DataDecoder(TestInstrumentation.buf).decode()
+        instrumentation.remove_sink(sink)
+        self.assertFalse(instrumentation.enabled)
+        recorded = sink.summary()
+        self.assertEqual(recorded[("datasource.decode", "seconds")]["count"], 1)
+        DataDecoder(TestInstrumentation.buf).decode()
+        self.assertEqual(sink.summary(), recorded)
+        stream = StringIO()
+        with instrumentation.profile(instrumentation.JsonLinesSink(stream)):
+            DataDecoder(TestInstrumentation.buf).decode()
+        DataDecoder(TestInstrumentation.buf).decode()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([(line["name"], line["metric"]) for line in lines],
+                         [("datasource.decode", "seconds"), ("datasource.decode", "bytes")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,13 +9,14 @@ from explorer_util import datasource
 
 class TestPrincipalComponents(unittest.TestCase): 
 
-    dataset_1 = None
+    dataset_1, dataset_1_file = None, None
 
     @classmethod
     def setUpClass(cls):
         # Compose absolute path to make the test runnable from the unittest cli as well.
         module_path = Path(os.path.dirname(os.path.abspath(__file__)))
-        cls.dataset_1 = datasource.DataSource().load(module_path / "dataset1.csv")
+        cls.dataset_1_file = module_path / "dataset1.csv"
+        cls.dataset_1 = datasource.DataSource().load(cls.dataset_1_file)
 
     @classmethod
     def tearDownClass(cls):
@@ -31,6 +32,39 @@ class TestPrincipalComponents(unittest.TestCase):
         testing.assert_allclose(components[0].v, np.array([0.825, 0.565]), 0.001)
         testing.assert_allclose(components[1].v, np.array([-0.565, 0.825]), 0.001)
 
+    def test_principal_components_from_chunks(self):
+        reader = datasource.CsvReader(TestPrincipalComponents.dataset_1_file, chunk_rows=4)
+        streamed = list(component.ComponentEvaluator.from_chunks(reader))
+        components = list(component.ComponentEvaluator(TestPrincipalComponents.dataset_1))
+        self.assertEqual(len(streamed), len(components))
+        for s, c in zip(streamed, components):
+            testing.assert_allclose(s.center, c.center)
+            testing.assert_allclose(s.length, c.length)
+            testing.assert_allclose(s.v, c.v, atol=1e-12)
+
+    def test_top_k_solvers(self):
+        rng = np.random.default_rng(4)
+        data = rng.normal(size=(500, 3)) @ rng.normal(size=(3, 40)) + 0.01 * rng.normal(size=(500, 40))
+        reference = list(component.ComponentEvaluator(data))
+        for solver in component.SOLVERS:
+            components = list(component.ComponentEvaluator(data, k=3, solver=solver, random_state=0))
+            self.assertEqual(len(components), 3)
+            for c, r in zip(components, reference):
+                testing.assert_allclose(c.length, r.length.real, rtol=1e-6)
+                testing.assert_allclose(abs(np.dot(c.v, r.v.real)), 1, rtol=1e-6)
+        with self.assertRaises(ValueError):
+            component.ComponentEvaluator(data, solver='qr')
+
+    def test_principal_components_2d_batch(self):
+        rng = np.random.default_rng(5)
+        points = rng.normal(size=(100, 50, 2)) * [3, 1]
+        center_vector, eigen_values, eigen_vector = component.principal_components_2d(points)
+        for i in (0, 42, 99):
+            reference = list(component.ComponentEvaluator(points[i]))
+            testing.assert_allclose(center_vector[i], reference[0].center)
+            testing.assert_allclose(np.sqrt(eigen_values[i]), [c.length for c in reference])
+            testing.assert_allclose(np.abs(np.sum(eigen_vector[i].T * [c.v for c in reference], 1)), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,7 @@ from pathlib import Path
 import os
 import unittest
 import numpy as np
-from sequence import discrete
+from sequence import discrete, decimation
 from explorer_util.datasource import DataSource, load_excel_doc_from_buf, get_columns_from_xlsx_workbook
 
 
@@ -43,6 +43,10 @@ class TestSequence(unittest.TestCase):
                               upper=datetime.datetime(2023, 5, 1, 0, 0, 0))
         self.assertEqual(len(ts1.data), 0)
         self.assertEqual(len(ts2.data), 2)
+        # Scalar bounds as strings with a 'Z' suffix, and mixed types
+        self.assertEqual(len(discrete.Series(TestSequence.dataset_2).segment('2023-02-28Z', '2023-05-01Z')), 2)
+        self.assertEqual(len(discrete.Series(TestSequence.dataset_2).segment(
+            np.datetime64('2023-02-28'), datetime.datetime(2023, 5, 1, tzinfo=datetime.timezone.utc))), 2)
 
     def test_filter_by_datetime_xlsx(self):
         ts1 = discrete.Series(TestSequence.dataset_2_xlsx)
@@ -61,6 +65,93 @@ class TestSequence(unittest.TestCase):
         rate_per_second = 10. * (1. / (30.5 * 24 * 60 * 60))
         self.assertAlmostEqual(coeff[0], rate_per_second)
 
+    def test_time_column_conversion(self):
+        ts = discrete.Series(TestSequence.dataset_2)
+        self.assertEqual(ts.time.dtype, np.dtype('datetime64[us]'))
+        self.assertEqual(ts.values.dtype, np.float64)
+        expected = [d.replace(tzinfo=datetime.timezone.utc).timestamp() for d in TestSequence.dataset_2[:, 0]]
+        np.testing.assert_array_equal(ts.epoch_seconds(), expected)
+        iso = discrete.Series(time=np.array(['2023-03-01T10:00:00', '2023-04-01T10:00:00']), values=[10, 20],
+                              tz=datetime.timezone(datetime.timedelta(hours=2)))
+        np.testing.assert_array_equal(iso.time, ts.time[:2])
+        epoch = discrete.Series(time=np.array(expected[:2]) * 1000, values=[10, 20], unit='ms')
+        np.testing.assert_array_equal(epoch.time, ts.time[:2])
+        aware = discrete.to_datetime64([datetime.datetime(2023, 3, 1, 9, tzinfo=datetime.timezone(datetime.timedelta(hours=1)))])
+        self.assertEqual(aware[0], ts.time[0])
+
+    def test_online_and_rolling_regression(self):
+        series = discrete.Series(TestSequence.dataset_3)
+        regression = discrete.Series(TestSequence.dataset_3[:500]).online_regression()
+        for x, y in TestSequence.dataset_3[500:]:
+            regression.update(x, y)
+        np.testing.assert_allclose(regression.coefficients(), series.linear_coefficients(), rtol=1e-9)
+        for add in (lambda r: r.update(3., 1.), lambda r: r.extend([3.], [1.]),
+                    lambda r: r.extend([3., 3.], [1., 2.])):
+            undefined = discrete.OnlineLinearRegression()
+            add(undefined)
+            self.assertTrue(np.all(np.isnan(undefined.coefficients())))
+        m, c = series.rolling_linear_coefficients(50)
+        self.assertEqual(len(m), 951)
+        for start in (0, 317, 950):
+            window = discrete.Series(TestSequence.dataset_3[start:start + 50])
+            np.testing.assert_allclose((m[start], c[start]), window.linear_coefficients(), rtol=1e-7)
+        ts = discrete.Series(TestSequence.dataset_2)
+        np.testing.assert_allclose(ts.rolling_linear_coefficients(4)[0], ts.linear_coefficients()[0], rtol=1e-7)
+        self.assertRaises(ValueError, ts.rolling_linear_coefficients, 1)
+
+    def test_rolling_regression_precision_on_long_series(self):
+        # One-minute samples in epoch seconds, far from the mean time for most windows
+        n = 500000
+        rng = np.random.default_rng(4)
+        values = np.cumsum(rng.normal(0, 1, n)) + 1000
+        series = discrete.Series(time=1.7e9 + 60 * np.arange(n), values=values, unit='s')
+        m, c = series.rolling_linear_coefficients(50)
+        x = series.epoch_seconds()
+        for start in rng.integers(0, len(m), 200):
+            xs, ys = x[start:start + 50], values[start:start + 50]
+            slope, _ = np.polyfit(xs - xs.mean(), ys, 1)
+            self.assertAlmostEqual(m[start], slope, delta=1e-7 * abs(slope))
+            self.assertAlmostEqual(m[start] * xs.mean() + c[start], ys.mean(), delta=1e-6)
+
+    def test_segments_are_views(self):
+        series = discrete.Series(TestSequence.dataset_3[::-1])
+        self.assertTrue(np.all(np.diff(series.time) >= 0))
+        segment = series.segment(100, 200)
+        self.assertEqual(len(segment), 99)
+        self.assertTrue(np.shares_memory(segment.values, series.values))
+        self.assertEqual(len(series), 1000)
+        counts = [len(s) for s in series.segments(np.array([-5, 10, 500]), np.array([5, 10, 1500]))]
+        self.assertEqual(counts, [5, 0, 499])
+        ts = discrete.Series(TestSequence.dataset_2)
+        months = ts.segments([datetime.datetime(2023, 3, 1), datetime.datetime(2023, 4, 15)],
+                             [datetime.datetime(2023, 4, 2), datetime.datetime(2023, 7, 1)])
+        self.assertEqual([len(s) for s in months], [2, 2])
+        self.assertEqual(months[1].data[0, 1], 30)
+
+    def test_decimation_preserves_shape(self):
+        x = np.arange(100001)
+        y = np.sin(x / 5000.) + np.random.default_rng(3).normal(0, 0.1, len(x))
+        y[31337] = 10
+        for method in ('minmax', 'lttb'):
+            indices = decimation.decimate(x, y, 400, method)
+            self.assertLessEqual(len(indices), 400)
+            self.assertEqual((indices[0], indices[-1]), (0, 100000))
+            self.assertIn(31337, indices)
+            self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertIn(np.argmin(y), decimation.decimate(x, y, 400))
+        series = discrete.Series(time=x, values=y).decimate(400, 'lttb')
+        self.assertEqual(len(series), 400)
+        points = decimation.decimate_points(y, x, 10, 10)
+        self.assertLessEqual(len(points), 100)
+        # NaN values are skipped, also in the last bucket and in buckets of only NaN values
+        y[-5] = np.nan
+        y[50000:52500] = np.nan
+        indices = decimation.decimate(x, y, 400)
+        self.assertEqual(indices[-1], 100000)
+        self.assertIn(31337, indices)
+        self.assertIn(np.nanargmin(y), indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,6 +1,14 @@
+import os
+import tempfile
 import unittest
 import numpy as np
-from pyspatialfield.field.featurefield import FeatureField
+from numpy import testing
+from pyspatialfield.field.featurefield import FeatureField, EllipseFeature, iter_tiles, fit_ellipses
+from pyspatialfield.field.featuretable import FeatureTable
+from pyspatialfield.field.background import BackgroundSubtractor
+from pyspatialfield.field.runlength import RunLengthFeature
+from pyspatialfield.field.componenttree import ComponentTree
+from pyspatialfield.field.labeling import label_tiled
 
 
 class TestSpatialMoments(unittest.TestCase):
@@ -77,6 +85,148 @@ class TestSpatialMoments(unittest.TestCase):
         area = field.area
         self.assertEqual(area, np.sum(field.data))
 
+    def test_moment_table_matches_direct_sums(self):
+        data = np.random.default_rng(1).random((37, 23))
+        field = FeatureField(data, order=3)
+        x, y = np.mgrid[:37, :23]
+        xmean, ymean = field.centroid()
+        for i in range(4):
+            for j in range(4):
+                self.assertAlmostEqual(field.spatial_moment((i, j)) / np.sum((x ** i * y ** j) * data), 1, places=10)
+                expected = np.sum(((x - xmean) ** i * (y - ymean) ** j) * data)
+                self.assertAlmostEqual(field.spatial_center_moment((i, j)), expected, delta=1e-8 * abs(expected) + 1e-8)
+
+    def test_center_moments_far_from_origin(self):
+        data = np.zeros((4100, 4100), dtype=bool)
+        data[4000:4007, 4000:4009] = True
+        data[4007, 4002:4005] = True
+        x, y = np.nonzero(data)
+        xmean, ymean = np.mean(x), np.mean(y)
+        field = FeatureField(data, order=3)
+        tiled = FeatureField.from_tiles(iter_tiles(data, (1024, 1024)), order=3)
+        runs = FeatureField.from_runs(RunLengthFeature.from_mask(data), order=3)
+        for i, j in ((2, 2), (2, 1), (3, 0), (0, 3), (1, 1)):
+            expected = np.sum((x - xmean) ** i * (y - ymean) ** j)
+            for f in (field, tiled, runs):
+                self.assertAlmostEqual(f.spatial_center_moment((i, j)), expected, delta=1e-9 * max(abs(expected), 1))
+
+    def test_moments_independent_of_large_origin(self):
+        mask = np.zeros((8, 10), dtype=bool)
+        mask[:7, :9] = True
+        mask[7, 2:5] = True
+        local = FeatureField(mask, order=3)
+        for origin in ((40000, 40000), (200000, 200000)):
+            field = FeatureField(mask, order=3, origin=origin)
+            testing.assert_allclose(field.center_moments(), local.center_moments(), atol=1e-9)
+            self.assertEqual(field.centroid(), (local.centroid()[0] + origin[0], local.centroid()[1] + origin[1]))
+            x, y = np.nonzero(mask)
+            self.assertAlmostEqual(field.spatial_moment((2, 1)) / np.sum((x + origin[0]) ** 2 * (y + origin[1])), 1,
+                                   places=12)
+
+    def test_moment_cache_invalidated_on_data_assignment(self):
+        field = FeatureField(TestSpatialMoments.dataset_1)
+        self.assertEqual(field.centroid(), (4, 5))
+        field.data = TestSpatialMoments.dataset_2
+        self.assertEqual(field.centroid(), (5, 4))
+        self.assertEqual(field.area, 15)
+
+    def test_tiled_moments_match_in_memory(self):
+        data = np.random.default_rng(2).random((45, 31))
+        field = FeatureField(data)
+        with tempfile.TemporaryDirectory() as directory:
+            mapped = np.memmap(os.path.join(directory, "field.dat"), dtype=np.float64, mode="w+", shape=data.shape)
+            mapped[:] = data
+            tiled = FeatureField.from_tiles(iter_tiles(mapped, (8, 10)))
+            self.assertEqual(tiled.dim, (45, 31))
+            testing.assert_allclose(tiled.centroid(), field.centroid())
+            testing.assert_allclose(tiled.center_moments(), field.center_moments(), atol=1e-9)
+            self.assertAlmostEqual(tiled.rad, field.rad)
+            del mapped
+
+    def test_cropped_feature_in_global_coordinates(self):
+        map = np.zeros((10, 10), dtype=np.int32)
+        map[TestSpatialMoments.dataset_4] = 3
+        full = FeatureField(FeatureField.get_feature_from_labelmap(map, 3))
+        mask, origin = FeatureField.get_feature_from_labelmap(map, 3, crop=True)
+        self.assertEqual(origin, (0, 3))
+        self.assertEqual(mask.shape, (9, 7))
+        cropped = FeatureField(mask, origin=origin)
+        self.assertEqual(cropped.centroid(), full.centroid())
+        testing.assert_allclose(cropped.center_moments(), full.center_moments(), atol=1e-9)
+        (label, mask, origin), = FeatureField.iter_features_from_labelmap(map)
+        self.assertEqual((label, origin), (3, (0, 3)))
+
+    def test_background_subtractor_detects_new_feature(self):
+        frames = []
+        for i in range(5):
+            frame = np.full((20, 20, 3), 100, dtype=np.uint8)
+            if i == 4:
+                frame[6:9, 10:14] = 200
+            frames.append(frame)
+        for method in ('ema', 'median'):
+            subtractor = BackgroundSubtractor(threshold=50, method=method, alpha=0.5, window=3)
+            results = [(labels.copy(), table) for labels, table in subtractor.run(frames)]
+            self.assertEqual(len(results[0][1]), 0)
+            labels, table = results[-1]
+            self.assertEqual(len(table), 1)
+            self.assertEqual(table.area[0], 12)
+            self.assertTrue(np.all(labels[6:9, 10:14] > 0))
+            self.assertEqual(subtractor.frame_count, 5)
+        # The median of the last 3 frames, with the history left intact
+        np.testing.assert_array_equal(subtractor.background, 100)
+        np.testing.assert_array_equal(np.sort(subtractor._history[:, 7, 11]), [100, 100, 200])
+
+    def test_fit_ellipses_batch(self):
+        fields = [FeatureField(d) for d in (TestSpatialMoments.dataset_1, TestSpatialMoments.dataset_3,
+                                            TestSpatialMoments.dataset_4)]
+        mu20, mu02, mu11 = [np.array([f.spatial_center_moment(m) for f in fields]) for m in ((2, 0), (0, 2), (1, 1))]
+        rad, eigen_values, eigen_vectors, semi_major_axis, semi_minor_axis = fit_ellipses(mu20, mu02, mu11)
+        # The eigenvalues and semi-axes in closed form, per feature
+        root = np.sqrt(4 * mu11 ** 2 + (mu20 - mu02) ** 2)
+        emax, emin = 0.5 * (mu20 + mu02 + root), 0.5 * (mu20 + mu02 - root)
+        scale = (4. / np.pi) ** (1. / 4.)
+        testing.assert_allclose(semi_major_axis, scale * (emax ** 3 / emin) ** (1. / 8.))
+        testing.assert_allclose(semi_minor_axis, scale * (emin ** 3 / emax) ** (1. / 8.))
+        # A 3 x 5 rectangle has mu20 = 10, mu02 = 30 and mu11 = 0
+        testing.assert_allclose((semi_major_axis[0], semi_minor_axis[0]), (2.8519900116, 1.6465972009))
+        for i, field in enumerate(fields):
+            ellipse = EllipseFeature()
+            ellipse.from_feature_field(field)
+            self.assertAlmostEqual(semi_major_axis[i], ellipse.semi_major_axis)
+            self.assertAlmostEqual(semi_minor_axis[i], ellipse.semi_minor_axis)
+            # field.rad is the major axis angle if mu20 > mu02, or mu20 = mu02 and mu11 > 0, and
+            # the minor axis angle otherwise
+            major = field.rad if mu20[i] > mu02[i] or (mu20[i] == mu02[i] and mu11[i] > 0) else field.rad + np.pi / 2
+            self.assertAlmostEqual(np.sin(rad[i] - major), 0)
+            self.assertTrue(-np.pi / 2 < rad[i] <= np.pi / 2)
+            cov = np.array([[mu20[i], mu11[i]], [mu11[i], mu02[i]]])
+            testing.assert_allclose(cov @ eigen_vectors[i], eigen_vectors[i] * eigen_values[i], atol=1e-9)
+        # A line and a single pixel
+        rad, eigen_values, _, semi_major_axis, semi_minor_axis = fit_ellipses([10., 0.], [0., 0.], [0., 0.])
+        testing.assert_array_equal(semi_minor_axis, [0, 0])
+        self.assertTrue(np.isnan(semi_major_axis[0]))
+        self.assertEqual(semi_major_axis[1], 0)
+
+    def test_run_length_features(self):
+        map = np.zeros((10, 10), dtype=np.int32)
+        map[TestSpatialMoments.dataset_3] = 1
+        map[:, 8:] = 2
+        map[9, 0:8] = 3
+        features = RunLengthFeature.from_labelmap(map)
+        self.assertEqual(sorted(features), [1, 2, 3])
+        testing.assert_array_equal(RunLengthFeature.to_labelmap(features, map.shape), map)
+        for label, feature in features.items():
+            mask = map == label
+            testing.assert_array_equal(feature.to_mask(map.shape), mask)
+            self.assertEqual(feature.area, np.sum(mask))
+            dense = FeatureField(mask, order=3)
+            runs = FeatureField.from_runs(feature, order=3)
+            testing.assert_allclose(runs.raw_moments(), dense.raw_moments())
+            self.assertAlmostEqual(runs.rad, dense.rad)
+        cropped, origin = FeatureField.get_feature_from_labelmap(map, 1, crop=True)
+        feature = RunLengthFeature.from_mask(cropped, origin)
+        testing.assert_array_equal(feature.to_mask(map.shape), map == 1)
+
     def test_get_feature_by_size(self):
         features = FeatureField.get_features_by_size(TestSpatialMoments.dataset_5)
         (f1_label, f1_size), (f2_label, f2_size), (f3_label, f3_size) = list(features)
@@ -90,6 +240,95 @@ class TestSpatialMoments(unittest.TestCase):
         self.assertEqual(f3_label, 1)
         self.assertEqual(f3_size, 2 * 2)
 
+    def test_feature_table_matches_feature_fields(self):
+        map = np.zeros((10, 10), dtype=np.int32)
+        map[TestSpatialMoments.dataset_1] = 1
+        map[TestSpatialMoments.dataset_4 & ~TestSpatialMoments.dataset_1] = 2
+        table = FeatureTable.from_labelmap(map)
+        testing.assert_array_equal(table.labels, [1, 2])
+        for i, label in enumerate(table.labels):
+            field = FeatureField(FeatureField.get_feature_from_labelmap(map, label))
+            ellipse = EllipseFeature()
+            ellipse.from_feature_field(field)
+            self.assertEqual(table.area[i], field.area)
+            testing.assert_allclose((table.xmean[i], table.ymean[i]), field.centroid())
+            self.assertAlmostEqual(table.mu11[i], field.spatial_center_moment((1, 1)))
+            self.assertAlmostEqual(table.rad[i], field.rad)
+            self.assertAlmostEqual(table.ellipse().semi_major_axis[i], ellipse.semi_major_axis)
+
+    def test_feature_table_by_size(self):
+        table = FeatureTable.from_labelmap(TestSpatialMoments.dataset_5)
+        self.assertEqual([(int(label), int(area)) for label, area in table.by_size()], [(2, 6), (1, 4)])
+
+    def test_component_tree_matches_labelling_per_threshold(self):
+        from scipy import ndimage
+        image = np.random.default_rng(1).integers(0, 8, (30, 40))
+        for connectivity in (1, 2):
+            tree = ComponentTree(image, connectivity=connectivity)
+            structure = ndimage.generate_binary_structure(2, connectivity)
+            for threshold in range(-1, 8):
+                map = tree.labelmap(threshold)
+                expected, count = ndimage.label(image > threshold, structure)
+                # Equal up to a permutation of the labels
+                self.assertEqual(map.max(), count)
+                pairs = np.unique(np.stack((map.ravel(), expected.ravel())), axis=1)
+                self.assertEqual(len(np.unique(pairs[0])), pairs.shape[1])
+                self.assertEqual(len(np.unique(pairs[1])), pairs.shape[1])
+                table, reference = tree.table(threshold), FeatureTable.from_labelmap(map)
+                testing.assert_allclose(table.area, reference.area)
+                testing.assert_allclose(table.mu20, reference.mu20, atol=1e-9)
+                testing.assert_allclose(table.mu11, reference.mu11, atol=1e-9)
+
+    def test_component_tree_persistence(self):
+        image = np.zeros((5, 9))
+        image[1:4, 1:4] = [[2, 2, 2], [2, 5, 2], [2, 2, 2]]
+        image[1:4, 5:8] = 3
+        image[2, 4] = 1
+        tree = ComponentTree(image, thresholds=[0, 1, 2, 4])
+        thresholds, tables, containers = tree.persistence([0, 2, 4, 1])
+        self.assertEqual(thresholds, [4, 2, 1, 0])
+        self.assertEqual([len(table) for table in tables], [1, 2, 2, 1])
+        testing.assert_array_equal(tables[2].area, [9, 9])
+        testing.assert_array_equal(tables[3].area, [19])
+        # The peak is contained in the left block, which only joins the right block below 1
+        left = np.argmin(tables[2].ymean)
+        self.assertEqual(containers[1][np.argmin(tables[1].area)], left)
+        testing.assert_array_equal(containers[2], [0, 0])
+        self.assertRaises(ValueError, tree.labelmap, 3)
+
+    def test_component_tree_float_image_levels(self):
+        image = np.random.default_rng(3).random((80, 80))
+        self.assertRaises(ValueError, ComponentTree, image)
+        tree = ComponentTree(image, thresholds=64)
+        self.assertEqual(len(tree.levels), 64)
+        threshold = tree.levels[40]
+        from scipy import ndimage
+        self.assertEqual(tree.labelmap(threshold).max(), ndimage.label(image > threshold)[1])
+
+    def test_tiled_labelling_matches_labelling(self):
+        from scipy import ndimage
+        rng = np.random.default_rng(2)
+        for connectivity in (1, 2):
+            structure = ndimage.generate_binary_structure(2, connectivity)
+            for tile_shape in ((7, 11), (1, 60), (60, 1)):
+                binary = rng.random((45, 60)) > 0.45
+                map, n = label_tiled(binary, tile_shape, workers=3, structure=structure)
+                expected, count = ndimage.label(binary, structure)
+                # Equal up to a permutation of the labels
+                self.assertEqual(n, count)
+                self.assertEqual(map.max(), count)
+                pairs = np.unique(np.stack((map.ravel(), expected.ravel())), axis=1)
+                self.assertEqual(len(np.unique(pairs[0])), pairs.shape[1])
+                self.assertEqual(len(np.unique(pairs[1])), pairs.shape[1])
+
+    def test_image_diff_with_tiled_labeler(self):
+        foreground = np.zeros((20, 20))
+        foreground[2:18, 9:11] = 50
+        foreground[9:11, 2:18] = 50
+        map = FeatureField.generate_from_image_diff(foreground, np.zeros((20, 20)),
+                                                    labeler=lambda binary: label_tiled(binary, (5, 5)))
+        testing.assert_array_equal(np.unique(map), [0, 1])
+
 
 if __name__ == '__main__':
     unittest.main()